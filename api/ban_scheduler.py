@@ -0,0 +1,82 @@
+import heapq
+import logging
+import threading
+
+from django.db import close_old_connections
+from django.utils import timezone
+
+from .models import Ban
+
+logger = logging.getLogger(__name__)
+
+
+class BanExpiryScheduler:
+    """
+    Deletes timed bans when they expire. Expiries sit in a heap and a single daemon thread
+    sleeps until the earliest one, so nothing polls the ban table.
+    Reads already ignore expired rows via ``Ban.objects.active()``; this only cleans them up.
+    ``stream_hub.asgi`` starts it in server processes, and the thread loads the pending
+    expiries itself so startup doesn't touch the database.
+    """
+    def __init__(self):
+        self._heap = []
+        self._condition = threading.Condition()
+        self._thread = None
+
+    def start(self):
+        with self._condition:
+            if self._thread is not None:
+                return
+            self._thread = threading.Thread(target=self._run, name='ban-expiry', daemon=True)
+            self._thread.start()
+
+    def schedule(self, ban_id, expires_at):
+        self.schedule_many([(ban_id, expires_at)])
+
+    def schedule_many(self, bans):
+        self.start()
+        with self._condition:
+            for ban_id, expires_at in bans:
+                heapq.heappush(self._heap, (expires_at.timestamp(), ban_id))
+            self._condition.notify()
+
+    def _load_pending(self):
+        # Pick up timeouts that were pending when the process last stopped
+        close_old_connections()
+        try:
+            pending = list(Ban.objects.filter(expires_at__isnull=False).values_list('pk', 'expires_at'))
+        except Exception:
+            logger.exception("Could not load pending ban expiries")
+            return
+        finally:
+            close_old_connections()
+        self.schedule_many(pending)
+
+    def _run(self):
+        self._load_pending()
+        while True:
+            with self._condition:
+                while not self._heap:
+                    self._condition.wait()
+                delay = self._heap[0][0] - timezone.now().timestamp()
+                if delay > 0:
+                    self._condition.wait(delay)
+                    continue
+                now = timezone.now().timestamp()
+                due = []
+                while self._heap and self._heap[0][0] <= now:
+                    due.append(heapq.heappop(self._heap)[1])
+            self._expire(due)
+
+    def _expire(self, ban_ids):
+        close_old_connections()
+        try:
+            # The expiry guard skips bans that were extended or made permanent after scheduling
+            Ban.objects.filter(pk__in=ban_ids, expires_at__lte=timezone.now()).delete()
+        except Exception:
+            logger.exception("Could not remove expired bans %s", ban_ids)
+        finally:
+            close_old_connections()
+
+
+ban_scheduler = BanExpiryScheduler()
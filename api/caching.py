@@ -0,0 +1,100 @@
+import hashlib
+import json
+import time
+
+from django.core.cache import cache
+from django.utils.cache import get_conditional_response
+from django.utils.http import http_date
+from rest_framework.response import Response
+
+USER_LIST_SCOPE = 'user_list'
+
+
+def stream_info_scope(username):
+    return f'stream_info:{username}'
+
+
+def _version_key(scope):
+    return f'version:{scope}'
+
+
+def _initial_version():
+    # Seeded from the clock so an evicted counter never comes back pointing at stale entries
+    return int(time.time() * 1000)
+
+
+def get_version(scope):
+    key = _version_key(scope)
+    version = cache.get(key)
+    if version is None:
+        cache.add(key, _initial_version(), timeout=None)
+        version = cache.get(key)
+    return version
+
+
+def bump_version(scope):
+    # Old entries are never deleted, they just stop being addressed and expire on their own
+    key = _version_key(scope)
+    try:
+        return cache.incr(key)
+    except ValueError:
+        cache.add(key, _initial_version(), timeout=None)
+        return cache.get(key)
+
+
+def invalidate_user(username):
+    bump_version(stream_info_scope(username))
+    bump_version(USER_LIST_SCOPE)
+
+
+class UncachedPayload(Exception):
+    """
+    Raised by a ``build`` callable to serve ``data`` once without caching it, e.g. a degraded
+    payload produced while an upstream service is failing.
+    """
+    def __init__(self, data):
+        super().__init__()
+        self.data = data
+
+
+def get_cached_payload(scope, build, timeout):
+    """
+    Return ``(data, etag, last_modified)`` for ``scope``, calling ``build()`` on a miss.
+    Exceptions raised by ``build`` propagate and nothing is cached; ``UncachedPayload``
+    is served but not cached.
+    """
+    key = f'response:{scope}:v{get_version(scope)}'
+    entry = cache.get(key)
+    if entry is None:
+        cacheable = True
+        try:
+            data = build()
+        except UncachedPayload as e:
+            data = e.data
+            cacheable = False
+        body = json.dumps(data, sort_keys=True, separators=(',', ':'))
+        entry = {
+            'data': data,
+            'etag': '"%s"' % hashlib.md5(body.encode('utf-8')).hexdigest(),
+            'last_modified': int(time.time()),
+        }
+        if cacheable:
+            cache.set(key, entry, timeout)
+    return entry['data'], entry['etag'], entry['last_modified']
+
+
+def conditional_response(request, scope, build, timeout, cache_control='public, no-cache'):
+    """
+    Serve a cached JSON payload with ``ETag``/``Last-Modified`` validators,
+    answering ``304 Not Modified`` when the client already has it.
+    Pass ``cache_control='private, no-cache'`` for payloads shared caches must not store.
+    """
+    data, etag, last_modified = get_cached_payload(scope, build, timeout)
+
+    not_modified = get_conditional_response(request, etag=etag, last_modified=last_modified)
+    response = not_modified if not_modified is not None else Response(data)
+    response['ETag'] = etag
+    response['Last-Modified'] = http_date(last_modified)
+    # no-cache: caches may keep the body but must revalidate, so a changed nickname is never served stale
+    response['Cache-Control'] = cache_control
+    return response
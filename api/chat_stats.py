@@ -0,0 +1,195 @@
+import atexit
+import hashlib
+import logging
+import math
+import threading
+import time
+from collections import Counter
+from datetime import datetime, timezone as dt_timezone
+
+from django.conf import settings
+from django.db import IntegrityError, close_old_connections, transaction
+
+from .models import ChatStatsBucket
+
+logger = logging.getLogger(__name__)
+
+HLL_PRECISION = 10 # 1024 one-byte registers, ~3% standard error
+HLL_REGISTERS = 1 << HLL_PRECISION
+HLL_ALPHA = 0.7213 / (1 + 1.079 / HLL_REGISTERS)
+_INVERSE_POWERS = [2.0 ** -rank for rank in range(65)]
+
+TOP_CHATTERS_PER_BUCKET = 25
+MAX_FLUSH_ATTEMPTS = 5 # A bucket that keeps failing (e.g. its stream was deleted) is dropped after this
+
+
+class HyperLogLog:
+    """
+    Fixed-size distinct counter. Sketches built in different processes or minutes merge
+    by taking the register-wise maximum.
+    """
+    def __init__(self, registers=None):
+        self.registers = bytearray(registers) if registers else bytearray(HLL_REGISTERS)
+
+    def add(self, value):
+        digest = hashlib.blake2b(str(value).encode('utf-8'), digest_size=8).digest()
+        hashed = int.from_bytes(digest, 'big')
+        index = hashed >> (64 - HLL_PRECISION)
+        remainder = hashed & ((1 << (64 - HLL_PRECISION)) - 1)
+        rank = (64 - HLL_PRECISION) - remainder.bit_length() + 1
+        if rank > self.registers[index]:
+            self.registers[index] = rank
+
+    def merge(self, other):
+        self.registers = bytearray(map(max, self.registers, other.registers))
+
+    def count(self):
+        estimate = HLL_ALPHA * HLL_REGISTERS * HLL_REGISTERS / sum(map(_INVERSE_POWERS.__getitem__, self.registers))
+        zeros = self.registers.count(0)
+        if estimate <= 2.5 * HLL_REGISTERS and zeros:
+            # Linear counting is far more accurate for small rooms
+            return round(HLL_REGISTERS * math.log(HLL_REGISTERS / zeros))
+        return round(estimate)
+
+
+class _PendingBucket:
+    __slots__ = ('message_count', 'sketch', 'chatters', 'attempts')
+
+    def __init__(self):
+        self.message_count = 0
+        self.sketch = HyperLogLog()
+        self.chatters = Counter()
+        self.attempts = 0
+
+    def merge(self, other):
+        self.message_count += other.message_count
+        self.sketch.merge(other.sketch)
+        self.chatters.update(other.chatters)
+        self.attempts = max(self.attempts, other.attempts)
+
+
+class ChatStatsAggregator:
+    """
+    Accumulates per-minute counters in memory as messages flow through ``ChatConsumer`` and
+    periodically merges them into ``ChatStatsBucket`` rows from a background thread.
+    """
+    def __init__(self, flush_interval):
+        self.flush_interval = flush_interval
+        self._pending = {}
+        self._lock = threading.Lock()
+        self._thread = None
+
+    def record(self, stream_id, user_id, username, now=None):
+        now = now or datetime.now(dt_timezone.utc)
+        minute = now.replace(second=0, microsecond=0)
+        with self._lock:
+            bucket = self._pending.get((stream_id, minute))
+            if bucket is None:
+                bucket = self._pending[(stream_id, minute)] = _PendingBucket()
+            bucket.message_count += 1
+            bucket.sketch.add(user_id)
+            bucket.chatters[username] += 1
+            if self._thread is None:
+                self._start()
+
+    def _start(self):
+        self._thread = threading.Thread(target=self._run, name='chat-stats-flush', daemon=True)
+        self._thread.start()
+        atexit.register(self.flush)
+
+    def _run(self):
+        while True:
+            time.sleep(self.flush_interval)
+            self.flush()
+
+    def flush(self):
+        with self._lock:
+            pending, self._pending = self._pending, {}
+        if not pending:
+            return
+        close_old_connections()
+        try:
+            for (stream_id, minute), bucket in pending.items():
+                try:
+                    self._write(stream_id, minute, bucket)
+                except Exception:
+                    self._requeue(stream_id, minute, bucket)
+        finally:
+            close_old_connections()
+
+    def _requeue(self, stream_id, minute, bucket):
+        bucket.attempts += 1
+        if bucket.attempts >= MAX_FLUSH_ATTEMPTS:
+            logger.exception("Dropping chat stats for stream %s at %s after %d attempts", stream_id, minute, bucket.attempts)
+            return
+        logger.warning("Could not flush chat stats for stream %s at %s; retrying", stream_id, minute, exc_info=True)
+        with self._lock:
+            # Messages recorded since the swap may have started a fresh bucket for the same minute
+            newer = self._pending.get((stream_id, minute))
+            if newer is not None:
+                bucket.merge(newer)
+            self._pending[(stream_id, minute)] = bucket
+
+    def _write(self, stream_id, minute, bucket):
+        # Rows can be shared with other processes (or an earlier flush of the same minute), so merge
+        for attempt in range(2):
+            try:
+                with transaction.atomic():
+                    row = ChatStatsBucket.objects.select_for_update().filter(stream_id=stream_id, minute=minute).first()
+                    if row is None:
+                        row = ChatStatsBucket(stream_id=stream_id, minute=minute)
+                        sketch = bucket.sketch
+                        chatters = bucket.chatters
+                    else:
+                        sketch = HyperLogLog(row.chatter_sketch)
+                        sketch.merge(bucket.sketch)
+                        chatters = Counter(row.top_chatters)
+                        chatters.update(bucket.chatters)
+                    row.message_count += bucket.message_count
+                    row.chatter_sketch = bytes(sketch.registers)
+                    row.chatter_estimate = sketch.count()
+                    row.top_chatters = dict(chatters.most_common(TOP_CHATTERS_PER_BUCKET))
+                    row.save()
+                return
+            except IntegrityError:
+                # Another process created the row between our read and insert; merge into it instead
+                if attempt:
+                    raise
+
+
+chat_stats = ChatStatsAggregator(settings.CHAT_STATS_FLUSH_INTERVAL)
+
+
+def summarize(stream, start, end):
+    """
+    Build the stats payload for ``stream`` between ``start`` and ``end`` from the rollups.
+    Cost is proportional to the number of minute buckets, not messages.
+    ``top_chatters`` is approximate: each bucket only keeps its own top
+    ``TOP_CHATTERS_PER_BUCKET``, so someone who chats steadily without ever making a minute's
+    top list is undercounted or missing over a long range.
+    """
+    buckets = ChatStatsBucket.objects.filter(stream=stream, minute__gte=start, minute__lt=end).order_by('minute')
+    total = 0
+    sketch = HyperLogLog()
+    chatters = Counter()
+    per_minute = []
+    for bucket in buckets.iterator():
+        total += bucket.message_count
+        sketch.merge(HyperLogLog(bucket.chatter_sketch))
+        chatters.update(bucket.top_chatters)
+        per_minute.append({
+            'minute': bucket.minute,
+            'messages': bucket.message_count,
+            'unique_chatters': bucket.chatter_estimate,
+        })
+    return {
+        'start': start,
+        'end': end,
+        'messages': total,
+        'unique_chatters': sketch.count() if total else 0,
+        'messages_per_minute': per_minute,
+        'top_chatters': [
+            {'username': username, 'messages': count}
+            for username, count in chatters.most_common(10)
+        ],
+    }
@@ -1,10 +1,22 @@
+import asyncio
 import json
+import time
 from channels.generic.websocket import AsyncWebsocketConsumer
-from channels.db import database_sync_to_async
+from django.conf import settings
 from django.contrib.auth.models import User
-from .models import Stream, ChatMessage, Ban, Profile # Import Profile
+from django.utils.dateparse import parse_datetime
+from .models import Stream, ChatMessage, Ban
+from .display_names import display_name_group, display_names, remember_display_name, resolve_display_name
+from .content_filter import discard_content_filter, get_duplicate_tracker, load_content_filter
+from .chat_stats import chat_stats
+from .notifications import (
+    PRESENCE_REFRESH_INTERVAL, mark_delivered, mark_offline, mark_online, notification_group, pop_inbox,
+    refresh_presence,
+)
+from .tracing import span, traced_db, traced_handler
 
 class ChatConsumer(AsyncWebsocketConsumer):
+    @traced_handler('ws.connect')
     async def connect(self):
         self.room_name = self.scope['url_route']['kwargs']['room_name']
         self.room_group_name = f'chat_{self.room_name}'
@@ -20,15 +32,28 @@ class ChatConsumer(AsyncWebsocketConsumer):
             await self.close()
             return
 
-        await self.channel_layer.group_add(
-            self.room_group_name,
-            self.channel_name
-        )
+        self.content_filter = await self.get_content_filter()
+        self.content_filter_loaded_at = time.monotonic()
+        self.duplicate_tracker = get_duplicate_tracker(self.streamer.pk)
+
+        # Resolved once per session; kept fresh by display_name_changed broadcasts
+        self.display_name = await self.get_user_display_name(self.user)
+
+        with span('group_add'):
+            await self.channel_layer.group_add(
+                self.room_group_name,
+                self.channel_name
+            )
+            if self.user.is_authenticated:
+                await self.channel_layer.group_add(
+                    display_name_group(self.user.pk),
+                    self.channel_name
+                )
         await self.accept()
 
         history = await self.get_chat_history()
         for message in history:
-            payload = await self.build_message_payload(message.user, message.message)
+            payload = self.build_message_payload(message.user, message.message)
             await self.send(text_data=json.dumps(payload))
 
     async def disconnect(self, close_code):
@@ -36,7 +61,13 @@ class ChatConsumer(AsyncWebsocketConsumer):
             self.room_group_name,
             self.channel_name
         )
+        if self.user.is_authenticated:
+            await self.channel_layer.group_discard(
+                display_name_group(self.user.pk),
+                self.channel_name
+            )
 
+    @traced_handler('ws.receive')
     async def receive(self, text_data):
         if not self.user.is_authenticated:
             await self.send_error("You must be logged in to chat.")
@@ -44,25 +75,48 @@ class ChatConsumer(AsyncWebsocketConsumer):
 
         text_data_json = json.loads(text_data)
         message_text = text_data_json['message']
+        # Checked before anything else runs on the message, filters included
+        if not isinstance(message_text, str) or len(message_text) > settings.CHAT_MESSAGE_MAX_LENGTH:
+            await self.send_error(f"Messages can be at most {settings.CHAT_MESSAGE_MAX_LENGTH} characters.")
+            return
 
         is_banned = await self.is_user_banned()
         if is_banned:
             await self.send_error("You are banned from this chat.")
             return
 
-        chat_message = await self.save_message(message_text)
-        display_name = await self.get_user_display_name(self.user)
-
-        await self.channel_layer.group_send(
-            self.room_group_name,
-            {
-                'type': 'chat_message',
-                'message': chat_message.message,
-                'username': self.user.username,
-                'display_name': display_name,
-            }
-        )
+        # The streamer moderates their own room and is exempt from its filters
+        if self.user.pk != self.streamer.pk:
+            # Periodic reload lets the registry pick up edits whose room event went to another process
+            now = time.monotonic()
+            if self.content_filter is None or now - self.content_filter_loaded_at >= settings.CHAT_FILTER_RECHECK_SECONDS:
+                self.content_filter = await self.get_content_filter()
+                self.content_filter_loaded_at = now
+            with span('content_filter'):
+                reason = self.content_filter.check(message_text, self.user.pk, self.duplicate_tracker)
+            if reason:
+                await self.send_error(f"Your message was blocked: {reason}.")
+                return
 
+        chat_message = await self.save_message(message_text)
+        chat_stats.record(self.stream.pk, self.user.pk, self.user.username)
+
+        with span('group_send'):
+            await self.channel_layer.group_send(
+                self.room_group_name,
+                {
+                    'type': 'chat_message',
+                    'message': chat_message.message,
+                    'username': self.user.username,
+                    'display_name': self.display_name,
+                }
+            )
+
+    async def send(self, *args, **kwargs):
+        with span('ws.send'):
+            await super().send(*args, **kwargs)
+
+    @traced_handler('ws.deliver')
     async def chat_message(self, event):
         await self.send(text_data=json.dumps({
             'message': event['message'],
@@ -70,35 +124,55 @@ class ChatConsumer(AsyncWebsocketConsumer):
             'display_name': event.get('display_name', event['username']),
         }))
 
+    async def chat_purge(self, event):
+        # One tombstone per purge; clients drop that user's messages from their view
+        await self.send(text_data=json.dumps({
+            'purged_username': event['username'],
+        }))
+
+    async def display_name_changed(self, event):
+        # Only this user's own sessions get the event; other processes' LRUs age out via their TTL
+        display_names.set(event['user_id'], event['display_name'])
+        self.display_name = event['display_name']
+
+    async def content_filter_changed(self, event):
+        # Rebuilt lazily on the next message so a burst of rule edits compiles once
+        discard_content_filter(event['streamer_id'])
+        self.content_filter = None
+
     async def send_error(self, message):
         await self.send(text_data=json.dumps({
             'error': message,
         }))
 
-    @database_sync_to_async
+    @traced_db('db.get_streamer')
     def get_streamer(self):
         try:
             return User.objects.get(username=self.room_name)
         except User.DoesNotExist:
             return None
 
-    @database_sync_to_async
+    @traced_db('db.get_stream_instance')
     def get_stream_instance(self):
         try:
             return Stream.objects.get(user=self.streamer)
         except Stream.DoesNotExist:
             return None
     
-    @database_sync_to_async
+    @traced_db('db.get_content_filter')
+    def get_content_filter(self):
+        return load_content_filter(self.streamer)
+
+    @traced_db('db.get_chat_history')
     def get_chat_history(self):
-        messages = ChatMessage.objects.filter(stream=self.stream).order_by('timestamp')[:50] # Changed to oldest-first
+        messages = ChatMessage.objects.filter(stream=self.stream).select_related('user__profile').order_by('timestamp')[:50] # Changed to oldest-first
         return list(messages)
 
-    @database_sync_to_async
+    @traced_db('db.is_user_banned')
     def is_user_banned(self):
-        return Ban.objects.filter(streamer=self.streamer, banned_user=self.user).exists()
+        return Ban.objects.active().filter(streamer=self.streamer, banned_user=self.user).exists()
 
-    @database_sync_to_async
+    @traced_db('db.save_message')
     def save_message(self, message_text):
         return ChatMessage.objects.create(
             user=self.user,
@@ -106,19 +180,72 @@ class ChatConsumer(AsyncWebsocketConsumer):
             message=message_text
         )
 
-    @database_sync_to_async
+    @traced_db('db.get_user_display_name')
     def get_user_display_name(self, user_instance):
-        if user_instance.is_authenticated:
-            try:
-                return user_instance.profile.nickname
-            except Profile.DoesNotExist:
-                return user_instance.username # Fallback to username if no profile
-        return "Anonymous"
-
-    async def build_message_payload(self, user_instance, message_text):
-        display_name = await self.get_user_display_name(user_instance)
+        return resolve_display_name(user_instance)
+
+    def build_message_payload(self, user_instance, message_text):
+        # History rows come with user__profile preloaded: that nickname is fresher than the LRU
+        display_name = remember_display_name(user_instance)
         return {
             'message': message_text,
             'username': getattr(user_instance, 'username', 'Anonymous'),
             'display_name': display_name,
         }
+
+
+class NotificationConsumer(AsyncWebsocketConsumer):
+    async def connect(self):
+        self.user = self.scope.get('user')
+        if not self.user or not self.user.is_authenticated:
+            await self.close()
+            return
+
+        self.group_name = notification_group(self.user.pk)
+        # Newest pushed notification not yet recorded; saved in batches, not per event
+        self.delivered_at = None
+        await self.channel_layer.group_add(
+            self.group_name,
+            self.channel_name
+        )
+        await mark_online(self.user.pk)
+        self.presence_task = asyncio.create_task(self.keep_presence())
+        await self.accept()
+
+        # Deliver what arrived while this user had no notification socket open
+        for payload in await pop_inbox(self.user.pk):
+            await self.send(text_data=json.dumps(payload))
+
+    async def keep_presence(self):
+        while True:
+            await asyncio.sleep(PRESENCE_REFRESH_INTERVAL)
+            await refresh_presence(self.user.pk)
+            await self.save_delivered()
+
+    async def save_delivered(self):
+        delivered_at, self.delivered_at = self.delivered_at, None
+        if delivered_at is not None:
+            await mark_delivered(self.user.pk, delivered_at)
+
+    async def disconnect(self, close_code):
+        if not getattr(self, 'group_name', None):
+            return
+        self.presence_task.cancel()
+        await self.save_delivered()
+        await mark_offline(self.user.pk)
+        await self.channel_layer.group_discard(
+            self.group_name,
+            self.channel_name
+        )
+
+    async def go_live(self, event):
+        await self.send(text_data=json.dumps({
+            'type': 'go_live',
+            'username': event['username'],
+            'nickname': event['nickname'],
+            'stream_uid': event['stream_uid'],
+            'created_at': event['created_at'],
+        }))
+        created_at = parse_datetime(event['created_at'])
+        if self.delivered_at is None or created_at > self.delivered_at:
+            self.delivered_at = created_at
@@ -0,0 +1,336 @@
+import logging
+import re
+import threading
+import time
+from collections import OrderedDict, deque
+
+from asgiref.sync import async_to_sync
+from channels.layers import get_channel_layer
+from django.conf import settings
+
+from .caching import bump_version, get_version
+from .models import ChatFilterRule, ChatFilterSettings
+
+try:
+    import re._parser as sre_parse
+except ImportError: # Python < 3.11
+    import sre_parse
+
+logger = logging.getLogger(__name__)
+
+# Only has to detect a link, not extract it; runs against the case-folded message
+LINK_RE = re.compile(r'https?://|www\.|\w\.(?:com|net|org|io|gg|tv|me|co|kr|ly|xyz)\b')
+
+# Per-room cap on tracked chatters and per-user cap on remembered message hashes
+DUPLICATE_MAX_USERS = 5000
+DUPLICATE_HISTORY = 20
+
+# Regex rules run synchronously on the consumer's event loop and Python's re can't be interrupted,
+# so validation refuses the shapes that backtrack catastrophically and caps how many can exist.
+# Even accepted rules like [a-z]+\d+ are quadratic in the input, so they only see a bounded prefix.
+MAX_REGEX_RULES = 50
+REGEX_SCAN_LIMIT = 300
+MAX_UNBOUNDED_REPEATS = 2
+_REPEAT_OPS = {op for op in (
+    sre_parse.MAX_REPEAT, sre_parse.MIN_REPEAT, getattr(sre_parse, 'POSSESSIVE_REPEAT', None),
+) if op is not None}
+
+
+def normalize(text):
+    return ' '.join(text.casefold().split())
+
+
+class TermMatcher:
+    """
+    Aho-Corasick automaton over case-folded banned terms. Matching is a single pass over
+    the message regardless of how many terms are loaded.
+    """
+    def __init__(self, terms):
+        self._goto = [{}]
+        self._fail = [0]
+        self._match = [False]
+        for term in terms:
+            term = normalize(term)
+            if term:
+                self._add(term)
+        self._build_failure_links()
+
+    def __bool__(self):
+        return len(self._goto) > 1
+
+    def _add(self, term):
+        state = 0
+        for ch in term:
+            next_state = self._goto[state].get(ch)
+            if next_state is None:
+                next_state = len(self._goto)
+                self._goto.append({})
+                self._fail.append(0)
+                self._match.append(False)
+                self._goto[state][ch] = next_state
+            state = next_state
+        self._match[state] = True
+
+    def _build_failure_links(self):
+        queue = deque(self._goto[0].values())
+        while queue:
+            state = queue.popleft()
+            for ch, next_state in self._goto[state].items():
+                queue.append(next_state)
+                fallback = self._fail[state]
+                while fallback and ch not in self._goto[fallback]:
+                    fallback = self._fail[fallback]
+                self._fail[next_state] = self._goto[fallback].get(ch, 0)
+                # A state matches if any suffix of it is a term
+                self._match[next_state] = self._match[next_state] or self._match[self._fail[next_state]]
+
+    def search(self, text):
+        goto = self._goto
+        fail = self._fail
+        match = self._match
+        state = 0
+        for ch in text:
+            while state and ch not in goto[state]:
+                state = fail[state]
+            state = goto[state].get(ch, 0)
+            if match[state]:
+                return True
+        return False
+
+
+class DuplicateTracker:
+    """
+    Rolling per-user window of recent message hashes for one room.
+    """
+    def __init__(self):
+        self._users = OrderedDict()
+        self._lock = threading.Lock()
+
+    def is_duplicate(self, user_id, fingerprint, window_seconds, limit, now=None):
+        now = time.monotonic() if now is None else now
+        cutoff = now - window_seconds
+        with self._lock:
+            recent = self._users.get(user_id)
+            if recent is None:
+                recent = self._users[user_id] = deque(maxlen=DUPLICATE_HISTORY)
+                if len(self._users) > DUPLICATE_MAX_USERS:
+                    self._users.popitem(last=False)
+            else:
+                self._users.move_to_end(user_id)
+            while recent and recent[0][0] < cutoff:
+                recent.popleft()
+            repeats = sum(1 for _, seen in recent if seen == fingerprint)
+            if repeats >= limit:
+                return True
+            recent.append((now, fingerprint))
+            return False
+
+
+class ContentFilter:
+    """
+    Compiled moderation rules of a single streamer. ``check`` does no DB access and returns
+    the reason a message should be blocked, or ``None``.
+    """
+    def __init__(self, terms=(), patterns=(), block_links=False,
+                 duplicate_window_seconds=30, duplicate_limit=3):
+        self.terms = TermMatcher(terms)
+        self.patterns = compile_patterns(patterns)
+        self.block_links = block_links
+        self.duplicate_window_seconds = duplicate_window_seconds
+        self.duplicate_limit = duplicate_limit
+
+    def check(self, text, user_id=None, tracker=None):
+        normalized = normalize(text)
+        if self.terms and self.terms.search(normalized):
+            return 'banned term'
+        if self.patterns is not None and self.patterns.search(text, 0, REGEX_SCAN_LIMIT):
+            return 'banned pattern'
+        if self.block_links and LINK_RE.search(normalized):
+            return 'links are not allowed'
+        if tracker is not None and self.duplicate_limit:
+            if tracker.is_duplicate(user_id, hash(normalized), self.duplicate_window_seconds, self.duplicate_limit):
+                return 'repeated message'
+        return None
+
+
+def join_patterns(patterns):
+    """
+    Compile ``(pattern, ignore_case)`` pairs into one alternation so a message is scanned once,
+    not once per rule. Case-insensitivity is scoped to the rules that ask for it.
+    """
+    return re.compile('|'.join(f'(?i:{p})' if ignore_case else f'(?:{p})' for p, ignore_case in patterns))
+
+
+def compile_patterns(patterns):
+    """
+    Compile the joined alternation, dropping any stored rule that no longer compiles
+    (e.g. saved before validation existed) rather than failing the whole room.
+    """
+    if not patterns:
+        return None
+    try:
+        return join_patterns(patterns)
+    except re.error:
+        valid = []
+        for pattern in patterns:
+            try:
+                join_patterns([pattern])
+            except re.error as e:
+                logger.warning("Skipping chat filter pattern %r: %s", pattern[0], e)
+            else:
+                valid.append(pattern)
+        try:
+            return join_patterns(valid) if valid else None
+        except re.error:
+            logger.exception("Chat filter patterns don't compile together; regex rules disabled")
+            return None
+
+
+def _check_backtracking(items, inside_repeat, unbounded):
+    for op, av in items:
+        if op in _REPEAT_OPS:
+            low, high, body = av
+            if high > 1:
+                if inside_repeat:
+                    raise ValueError('Nested quantifiers such as (?:a+)+ are not allowed in filter patterns.')
+                if high == sre_parse.MAXREPEAT or high > 100:
+                    unbounded[0] += 1
+                    if unbounded[0] > MAX_UNBOUNDED_REPEATS:
+                        raise ValueError(
+                            f'Filter patterns may use at most {MAX_UNBOUNDED_REPEATS} unbounded quantifiers.'
+                        )
+            _check_backtracking(body, inside_repeat or high > 1, unbounded)
+        elif op is sre_parse.BRANCH:
+            if inside_repeat:
+                raise ValueError('Alternation inside a repeated group is not allowed in filter patterns.')
+            for branch in av[1]:
+                _check_backtracking(branch, inside_repeat, unbounded)
+        elif op is sre_parse.SUBPATTERN:
+            _check_backtracking(av[-1], inside_repeat, unbounded)
+        elif op in (sre_parse.ASSERT, sre_parse.ASSERT_NOT):
+            _check_backtracking(av[1], inside_repeat, unbounded)
+        elif op is getattr(sre_parse, 'ATOMIC_GROUP', None):
+            _check_backtracking(av, inside_repeat, unbounded)
+
+
+def validate_regex(pattern, ignore_case=False, existing=()):
+    """
+    Raise ``ValueError`` if ``pattern`` can't join the streamer's ``existing`` ``(pattern, ignore_case)``
+    rules in the combined alternation. Capturing groups are refused because they would renumber each
+    other's backreferences; inline global flags like ``(?i)`` are refused by the join itself.
+    """
+    try:
+        compiled = join_patterns([(pattern, ignore_case)])
+    except re.error as e:
+        raise ValueError(f'Invalid regular expression: {e}')
+    if compiled.groups:
+        raise ValueError('Use non-capturing groups (?:...) in filter patterns.')
+    _check_backtracking(sre_parse.parse(pattern), False, [0])
+    try:
+        join_patterns([*existing, (pattern, ignore_case)])
+    except re.error as e:
+        raise ValueError(f'Pattern conflicts with your other filter patterns: {e}')
+
+
+_filters = OrderedDict()
+_trackers = OrderedDict()
+_registry_lock = threading.Lock()
+
+
+class _CachedFilter:
+    __slots__ = ('content_filter', 'version', 'checked_at')
+
+    def __init__(self, content_filter, version, checked_at):
+        self.content_filter = content_filter
+        self.version = version
+        self.checked_at = checked_at
+
+
+def filter_scope(streamer_id):
+    return f'chat_filter:{streamer_id}'
+
+
+def _remember(registry, key, value):
+    registry[key] = value
+    registry.move_to_end(key)
+    while len(registry) > settings.CHAT_FILTER_CACHE_SIZE:
+        registry.popitem(last=False)
+
+
+def build_content_filter(streamer):
+    terms, patterns = [], []
+    rules = ChatFilterRule.objects.filter(streamer=streamer).values_list('kind', 'pattern', 'ignore_case')
+    for kind, pattern, ignore_case in rules:
+        if kind == ChatFilterRule.KIND_REGEX:
+            patterns.append((pattern, ignore_case))
+        else:
+            terms.append(pattern)
+    settings_row = ChatFilterSettings.objects.filter(streamer=streamer).first()
+    options = {}
+    if settings_row:
+        options = {
+            'block_links': settings_row.block_links,
+            'duplicate_window_seconds': settings_row.duplicate_window_seconds,
+            'duplicate_limit': settings_row.duplicate_limit,
+        }
+    return ContentFilter(terms, patterns, **options)
+
+
+def load_content_filter(streamer):
+    """
+    Return the compiled filter for ``streamer``. The per-process copy is trusted for
+    ``CHAT_FILTER_RECHECK_SECONDS``; after that the version in the shared cache decides whether
+    it gets rebuilt, so processes that missed the room event still converge. Must be called
+    from sync code.
+    """
+    now = time.monotonic()
+    with _registry_lock:
+        entry = _filters.get(streamer.pk)
+        if entry is not None:
+            _filters.move_to_end(streamer.pk)
+    if entry is not None and now - entry.checked_at < settings.CHAT_FILTER_RECHECK_SECONDS:
+        return entry.content_filter
+
+    scope = filter_scope(streamer.pk)
+    version = get_version(scope)
+    if entry is not None and entry.version == version:
+        entry.checked_at = now
+        return entry.content_filter
+
+    content_filter = build_content_filter(streamer)
+    # Rules changed while we were reading them: keep the result but recheck on the next call
+    checked_at = now if get_version(scope) == version else float('-inf')
+    with _registry_lock:
+        _remember(_filters, streamer.pk, _CachedFilter(content_filter, version, checked_at))
+    return content_filter
+
+
+def get_duplicate_tracker(streamer_id):
+    with _registry_lock:
+        tracker = _trackers.get(streamer_id)
+        if tracker is None:
+            tracker = DuplicateTracker()
+        _remember(_trackers, streamer_id, tracker)
+        return tracker
+
+
+def discard_content_filter(streamer_id):
+    with _registry_lock:
+        _filters.pop(streamer_id, None)
+
+
+def broadcast_filter_change(streamer):
+    # The version bump reaches every process on its next recheck; the room event makes
+    # processes with sockets in the room pick the change up immediately
+    bump_version(filter_scope(streamer.pk))
+    discard_content_filter(streamer.pk)
+    channel_layer = get_channel_layer()
+    if channel_layer is None:
+        return
+    async_to_sync(channel_layer.group_send)(
+        f'chat_{streamer.username}',
+        {
+            'type': 'content_filter_changed',
+            'streamer_id': streamer.pk,
+        }
+    )
@@ -0,0 +1,88 @@
+import threading
+import time
+from collections import OrderedDict
+
+from asgiref.sync import async_to_sync
+from channels.layers import get_channel_layer
+from django.conf import settings
+
+from .models import Profile
+
+def display_name_group(user_id):
+    # Joined only by that user's own chat sockets, so a nickname change costs one message per session
+    return f'display_name_{user_id}'
+
+
+class DisplayNameCache:
+    """
+    Process-wide LRU of ``user_id -> display name``. Entries also expire after ``ttl``
+    seconds, which bounds staleness in a process that missed an invalidation broadcast.
+    """
+    def __init__(self, maxsize, ttl):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, user_id):
+        with self._lock:
+            entry = self._entries.get(user_id)
+            if entry is None:
+                return None
+            display_name, expires_at = entry
+            if expires_at < time.monotonic():
+                del self._entries[user_id]
+                return None
+            self._entries.move_to_end(user_id)
+            return display_name
+
+    def set(self, user_id, display_name):
+        with self._lock:
+            self._entries[user_id] = (display_name, time.monotonic() + self.ttl)
+            self._entries.move_to_end(user_id)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+
+
+display_names = DisplayNameCache(settings.DISPLAY_NAME_CACHE_SIZE, settings.DISPLAY_NAME_CACHE_TTL)
+
+
+def resolve_display_name(user_instance):
+    """
+    Sync lookup through the LRU. Only touches the DB on a miss, and not even then when
+    ``profile`` was already loaded with ``select_related``.
+    """
+    if not user_instance.is_authenticated:
+        return "Anonymous"
+    display_name = display_names.get(user_instance.pk)
+    if display_name is None:
+        display_name = remember_display_name(user_instance)
+    return display_name
+
+
+def remember_display_name(user_instance):
+    """
+    Read the nickname from ``user_instance`` itself and refresh the LRU with it. Use this when
+    the profile was just loaded from the DB, so a stale LRU entry can't override it.
+    """
+    try:
+        display_name = user_instance.profile.nickname
+    except Profile.DoesNotExist:
+        display_name = user_instance.username # Fallback to username if no profile
+    display_names.set(user_instance.pk, display_name)
+    return display_name
+
+
+def broadcast_display_name_change(user_id, display_name):
+    display_names.set(user_id, display_name)
+    channel_layer = get_channel_layer()
+    if channel_layer is None:
+        return
+    async_to_sync(channel_layer.group_send)(
+        display_name_group(user_id),
+        {
+            'type': 'display_name_changed',
+            'user_id': user_id,
+            'display_name': display_name,
+        }
+    )
@@ -0,0 +1,91 @@
+import asyncio
+import hashlib
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import close_old_connections
+from rest_framework.authtoken.models import Token
+
+
+class LoginPoolSaturated(Exception):
+    pass
+
+
+class PasswordHashPool:
+    """
+    Bounded executor for password verification. PBKDF2 releases the GIL, so ``workers``
+    caps the CPU logins can take; at most ``queue_size`` more wait for a worker and
+    anything beyond that is refused immediately instead of piling up.
+    """
+    def __init__(self, workers, queue_size):
+        self.workers = workers
+        self.queue_size = queue_size
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='login-hash')
+        self._slots = threading.BoundedSemaphore(workers + queue_size)
+
+    async def run(self, func, *args):
+        if not self._slots.acquire(blocking=False):
+            raise LoginPoolSaturated()
+        try:
+            loop = asyncio.get_running_loop()
+            return await loop.run_in_executor(self._executor, self._call, func, args)
+        finally:
+            self._slots.release()
+
+    def _call(self, func, args):
+        try:
+            return func(*args)
+        finally:
+            # Pool threads live outside the request cycle, so nothing else closes their connections
+            close_old_connections()
+
+
+password_pool = PasswordHashPool(settings.LOGIN_HASH_WORKERS, settings.LOGIN_HASH_QUEUE)
+
+
+def _failure_keys(ip, username):
+    username_digest = hashlib.md5(username.encode('utf-8')).hexdigest()
+    return f'login_failures:ip:{ip}', f'login_failures:user:{username_digest}'
+
+
+async def is_throttled(ip, username):
+    ip_key, user_key = _failure_keys(ip, username)
+    failures = await cache.aget_many([ip_key, user_key])
+    return (
+        failures.get(ip_key, 0) >= settings.LOGIN_FAILURE_LIMIT_IP
+        or failures.get(user_key, 0) >= settings.LOGIN_FAILURE_LIMIT_USERNAME
+    )
+
+
+async def record_failure(ip, username):
+    for key in _failure_keys(ip, username):
+        # The window starts at the first failure and is not extended by later ones
+        await cache.aadd(key, 0, timeout=settings.LOGIN_FAILURE_WINDOW)
+        try:
+            await cache.aincr(key)
+        except ValueError:
+            pass
+
+
+async def clear_failures(ip, username):
+    await cache.adelete(_failure_keys(ip, username)[1])
+
+
+def token_cache_key(user_id):
+    return f'auth_token:{user_id}'
+
+
+def get_login_token(user):
+    key = token_cache_key(user.pk)
+    token_key = cache.get(key)
+    if token_key is None:
+        token, _ = Token.objects.get_or_create(user=user)
+        token_key = token.key
+        cache.set(key, token_key, timeout=settings.LOGIN_TOKEN_CACHE_TIMEOUT)
+        # A concurrent logout may have deleted the token (and cleared the key) before our set landed
+        if not Token.objects.filter(key=token_key).exists():
+            cache.delete(key)
+            token_key = Token.objects.get_or_create(user=user)[0].key
+    return token_key
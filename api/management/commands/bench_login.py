@@ -0,0 +1,48 @@
+import asyncio
+import time
+
+from django.conf import settings
+from django.contrib.auth.hashers import check_password, make_password
+from django.core.management.base import BaseCommand
+
+from api.login_pool import LoginPoolSaturated, PasswordHashPool
+
+
+class Command(BaseCommand):
+    help = 'Measure password verification throughput through the bounded login pool.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--attempts', type=int, default=200)
+        parser.add_argument('--workers', type=int, default=settings.LOGIN_HASH_WORKERS)
+        parser.add_argument('--queue', type=int, default=settings.LOGIN_HASH_QUEUE)
+
+    def handle(self, *args, **options):
+        encoded = make_password('correct horse battery staple')
+        pool = PasswordHashPool(options['workers'], options['queue'])
+        accepted, rejected, latencies = asyncio.run(self.burst(pool, encoded, options['attempts']))
+
+        elapsed = max(latencies) if latencies else 0
+        self.stdout.write(
+            f"{options['attempts']} concurrent attempts, {options['workers']} workers, queue {options['queue']}: "
+            f"{accepted} verified, {rejected} rejected as busy"
+        )
+        if accepted:
+            latencies.sort()
+            self.stdout.write(
+                f"{accepted / elapsed:.1f} verifications/s, "
+                f"p50 {latencies[len(latencies) // 2] * 1000:.0f} ms, max {latencies[-1] * 1000:.0f} ms"
+            )
+
+    async def burst(self, pool, encoded, attempts):
+        started = time.perf_counter()
+
+        async def attempt():
+            try:
+                await pool.run(check_password, 'wrong password', encoded)
+            except LoginPoolSaturated:
+                return None
+            return time.perf_counter() - started
+
+        results = await asyncio.gather(*[attempt() for _ in range(attempts)])
+        latencies = [latency for latency in results if latency is not None]
+        return len(latencies), attempts - len(latencies), latencies
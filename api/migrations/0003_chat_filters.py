@@ -0,0 +1,39 @@
+# Generated by Django 4.2.11 on 2026-10-19 15:14
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('api', '0002_profile'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ChatFilterSettings',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('block_links', models.BooleanField(default=False)),
+                ('duplicate_window_seconds', models.PositiveIntegerField(default=30)),
+                ('duplicate_limit', models.PositiveIntegerField(default=3)),
+                ('streamer', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, related_name='chat_filter_settings', to=settings.AUTH_USER_MODEL)),
+            ],
+        ),
+        migrations.CreateModel(
+            name='ChatFilterRule',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('kind', models.CharField(choices=[('term', 'Banned term'), ('regex', 'Regular expression')], default='term', max_length=10)),
+                ('pattern', models.CharField(max_length=255)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('streamer', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='chat_filter_rules', to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'unique_together': {('streamer', 'kind', 'pattern')},
+            },
+        ),
+    ]
@@ -0,0 +1,22 @@
+# Generated by Django 4.2.11 on 2026-10-19 15:17
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0003_chat_filters'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='ban',
+            name='expires_at',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.AddIndex(
+            model_name='chatmessage',
+            index=models.Index(fields=['stream', 'user', 'timestamp'], name='api_chatmes_stream__2c9c78_idx'),
+        ),
+    ]
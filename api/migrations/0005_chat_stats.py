@@ -0,0 +1,29 @@
+# Generated by Django 4.2.11 on 2026-10-19 15:18
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0004_moderation'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ChatStatsBucket',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('minute', models.DateTimeField()),
+                ('message_count', models.PositiveIntegerField(default=0)),
+                ('chatter_estimate', models.PositiveIntegerField(default=0)),
+                ('chatter_sketch', models.BinaryField()),
+                ('top_chatters', models.JSONField(default=dict)),
+                ('stream', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='chat_stats', to='api.stream')),
+            ],
+            options={
+                'unique_together': {('stream', 'minute')},
+            },
+        ),
+    ]
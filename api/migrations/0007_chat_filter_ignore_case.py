@@ -0,0 +1,18 @@
+# Generated by Django 4.2.11 on 2026-10-19 15:43
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0006_follows_notifications'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='chatfilterrule',
+            name='ignore_case',
+            field=models.BooleanField(default=False),
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 4.2.11 on 2026-10-19 15:46
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0007_chat_filter_ignore_case'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='profile',
+            name='notifications_seen_at',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+    ]
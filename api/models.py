@@ -1,11 +1,19 @@
 from django.db import models
 from django.contrib.auth.models import User
-from django.db.models.signals import post_save
+from django.db import transaction
+from django.utils import timezone
+from django.db.models.signals import post_save, post_delete
 from django.dispatch import receiver
+from django.core.cache import cache
+from rest_framework.authtoken.models import Token
+from .login_pool import token_cache_key
+from .caching import invalidate_user
 
 class Profile(models.Model):
     user = models.OneToOneField(User, on_delete=models.CASCADE)
     nickname = models.CharField(max_length=50, blank=True)
+    # Newest go-live notification pushed to a live socket; older inbox rows are already delivered
+    notifications_seen_at = models.DateTimeField(null=True, blank=True)
 
     def __str__(self):
         return f'{self.user.username} Profile'
@@ -17,12 +25,18 @@ def ensure_user_profile(sender, instance, created, **kwargs):
         profile.nickname = instance.username
         profile.save(update_fields=['nickname'])
 
+@receiver(post_delete, sender=Token)
+def forget_cached_token(sender, instance, **kwargs):
+    # LoginView caches token keys; a deleted token must not be handed out again
+    cache.delete(token_cache_key(instance.user_id))
+
 class Stream(models.Model):
     user = models.OneToOneField(User, on_delete=models.CASCADE)
     stream_key = models.CharField(max_length=255, unique=True)
     stream_url = models.CharField(max_length=255)
     viewer_url = models.CharField(max_length=255) # Actually stores the UID
     created_at = models.DateTimeField(auto_now_add=True)
+    is_live = models.BooleanField(default=False) # Set by Cloudflare live input webhooks
 
     def __str__(self):
         return self.user.username
@@ -33,16 +47,104 @@ class ChatMessage(models.Model):
     message = models.TextField()
     timestamp = models.DateTimeField(auto_now_add=True)
 
+    class Meta:
+        # Backs purging a user's recent messages in a room
+        indexes = [models.Index(fields=['stream', 'user', 'timestamp'])]
+
     def __str__(self):
         return f'{self.user.username}: {self.message}'
 
+class BanQuerySet(models.QuerySet):
+    def active(self):
+        # Expired timeouts are removed by the ban scheduler, but never trust that they already were
+        return self.filter(models.Q(expires_at__isnull=True) | models.Q(expires_at__gt=timezone.now()))
+
 class Ban(models.Model):
     streamer = models.ForeignKey(User, related_name='banned_by', on_delete=models.CASCADE)
     banned_user = models.ForeignKey(User, related_name='banned_user', on_delete=models.CASCADE)
     created_at = models.DateTimeField(auto_now_add=True)
+    expires_at = models.DateTimeField(null=True, blank=True) # None means a permanent ban
+
+    objects = BanQuerySet.as_manager()
 
     class Meta:
         unique_together = ('streamer', 'banned_user')
 
     def __str__(self):
         return f'{self.banned_user.username} banned by {self.streamer.username}'
+
+@receiver(post_save, sender=Profile)
+@receiver(post_delete, sender=Profile)
+@receiver(post_save, sender=Stream)
+@receiver(post_delete, sender=Stream)
+def invalidate_cached_responses(sender, instance, **kwargs):
+    # Bump after commit so a concurrent reader can't re-cache the pre-write rows under the new version
+    username = instance.user.username
+    transaction.on_commit(lambda: invalidate_user(username))
+
+class ChatFilterSettings(models.Model):
+    streamer = models.OneToOneField(User, related_name='chat_filter_settings', on_delete=models.CASCADE)
+    block_links = models.BooleanField(default=False)
+    duplicate_window_seconds = models.PositiveIntegerField(default=30)
+    duplicate_limit = models.PositiveIntegerField(default=3) # 0 disables duplicate detection
+
+    def __str__(self):
+        return f'{self.streamer.username} chat filter settings'
+
+class ChatFilterRule(models.Model):
+    KIND_TERM = 'term'
+    KIND_REGEX = 'regex'
+    KIND_CHOICES = (
+        (KIND_TERM, 'Banned term'),
+        (KIND_REGEX, 'Regular expression'),
+    )
+
+    streamer = models.ForeignKey(User, related_name='chat_filter_rules', on_delete=models.CASCADE)
+    kind = models.CharField(max_length=10, choices=KIND_CHOICES, default=KIND_TERM)
+    pattern = models.CharField(max_length=255)
+    ignore_case = models.BooleanField(default=False) # Regex only; terms are always case-folded
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        unique_together = ('streamer', 'kind', 'pattern')
+
+    def __str__(self):
+        return f'{self.kind} rule of {self.streamer.username}: {self.pattern}'
+
+class Follow(models.Model):
+    follower = models.ForeignKey(User, related_name='following', on_delete=models.CASCADE)
+    streamer = models.ForeignKey(User, related_name='followers', on_delete=models.CASCADE)
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        unique_together = ('follower', 'streamer')
+
+    def __str__(self):
+        return f'{self.follower.username} follows {self.streamer.username}'
+
+# Inbox for followers who were offline at go-live; one row per (user, streamer) keeps it bounded
+class GoLiveNotification(models.Model):
+    user = models.ForeignKey(User, related_name='go_live_notifications', on_delete=models.CASCADE)
+    streamer = models.ForeignKey(User, related_name='+', on_delete=models.CASCADE)
+    created_at = models.DateTimeField()
+
+    class Meta:
+        unique_together = ('user', 'streamer')
+
+    def __str__(self):
+        return f'{self.streamer.username} went live (for {self.user.username})'
+
+# Per-minute chat rollup written by api.chat_stats, so stats never scan ChatMessage
+class ChatStatsBucket(models.Model):
+    stream = models.ForeignKey(Stream, related_name='chat_stats', on_delete=models.CASCADE)
+    minute = models.DateTimeField()
+    message_count = models.PositiveIntegerField(default=0)
+    chatter_estimate = models.PositiveIntegerField(default=0)
+    chatter_sketch = models.BinaryField() # HyperLogLog registers
+    top_chatters = models.JSONField(default=dict) # username -> messages, trimmed to the busiest few
+
+    class Meta:
+        unique_together = ('stream', 'minute')
+
+    def __str__(self):
+        return f'{self.stream} @ {self.minute:%Y-%m-%d %H:%M}: {self.message_count} messages'
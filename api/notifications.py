@@ -0,0 +1,178 @@
+import asyncio
+import logging
+
+from channels.db import database_sync_to_async
+from channels.layers import get_channel_layer
+from django.conf import settings
+from django.core.cache import cache
+from django.db.models import Q
+from django.utils import timezone
+
+from .models import Follow, GoLiveNotification, Profile, Stream
+
+logger = logging.getLogger(__name__)
+
+# Presence only decides who gets a live push; every notification also lands in the inbox and only
+# counts as delivered once a socket has sent it, so a count leaked by a crashed process costs a
+# wasted send, not a lost event. Open sockets refresh the key well before it expires.
+PRESENCE_TIMEOUT = 5 * 60
+PRESENCE_REFRESH_INTERVAL = 60
+
+# Strong references so the event loop doesn't garbage-collect running fan-outs
+_fan_out_tasks = set()
+
+
+def notification_group(user_id):
+    return f'notifications_{user_id}'
+
+
+def presence_key(user_id):
+    return f'notifications_online:{user_id}'
+
+
+async def mark_online(user_id):
+    key = presence_key(user_id)
+    await cache.aadd(key, 0, timeout=PRESENCE_TIMEOUT)
+    try:
+        await cache.aincr(key)
+    except ValueError:
+        pass
+    await cache.atouch(key, PRESENCE_TIMEOUT)
+
+
+async def refresh_presence(user_id):
+    if not await cache.atouch(presence_key(user_id), PRESENCE_TIMEOUT):
+        # Expired or evicted while the socket stayed open
+        await mark_online(user_id)
+
+
+async def mark_offline(user_id):
+    try:
+        if await cache.adecr(presence_key(user_id)) <= 0:
+            await cache.adelete(presence_key(user_id))
+    except ValueError:
+        pass
+
+
+@database_sync_to_async
+def set_live_state(stream_uid, is_live):
+    """
+    Flip ``Stream.is_live`` and return the stream if this call changed it. The conditional
+    update makes the transition happen once even if Cloudflare retries the webhook.
+    """
+    changed = Stream.objects.filter(viewer_url=stream_uid, is_live=not is_live).update(is_live=is_live)
+    if not changed:
+        return None
+    return Stream.objects.select_related('user__profile').get(viewer_url=stream_uid)
+
+
+def schedule_go_live(stream):
+    task = asyncio.get_running_loop().create_task(fan_out_go_live(stream))
+    _fan_out_tasks.add(task)
+    task.add_done_callback(_fan_out_tasks.discard)
+
+
+@database_sync_to_async
+def get_follower_chunk(streamer_id, after_id, size):
+    return list(
+        Follow.objects.filter(streamer_id=streamer_id, id__gt=after_id)
+        .order_by('id')
+        .values_list('id', 'follower_id')[:size]
+    )
+
+
+@database_sync_to_async
+def store_in_inbox(user_ids, streamer_id, created_at):
+    GoLiveNotification.objects.bulk_create(
+        [GoLiveNotification(user_id=user_id, streamer_id=streamer_id, created_at=created_at) for user_id in user_ids],
+        update_conflicts=True,
+        unique_fields=['user', 'streamer'],
+        update_fields=['created_at'],
+    )
+
+
+@database_sync_to_async
+def mark_delivered(user_id, delivered_at):
+    """
+    Record that everything up to ``delivered_at`` reached one of the user's sockets. Sockets batch
+    this (see ``NotificationConsumer``) so a large fan-out doesn't turn into one write per push.
+    """
+    Profile.objects.filter(
+        Q(notifications_seen_at__isnull=True) | Q(notifications_seen_at__lt=delivered_at), user_id=user_id,
+    ).update(notifications_seen_at=delivered_at)
+
+
+async def fan_out_go_live(stream):
+    """
+    Push a go-live event to every follower of ``stream``. Followers are read in keyset-paginated
+    chunks; each chunk is written to the inbox first, then followers that look online get
+    concurrent channel-layer sends. The loop yields between chunks so a large follower list never
+    monopolizes the event loop.
+    """
+    channel_layer = get_channel_layer()
+    streamer = stream.user
+    created_at = timezone.now()
+    event = {
+        'type': 'go_live',
+        'username': streamer.username,
+        'nickname': streamer.profile.nickname,
+        'stream_uid': stream.viewer_url,
+        'created_at': created_at.isoformat(),
+    }
+    after_id = 0
+    notified = 0
+    try:
+        while True:
+            chunk = await get_follower_chunk(streamer.pk, after_id, settings.NOTIFICATION_FANOUT_CHUNK_SIZE)
+            if not chunk:
+                break
+            after_id = chunk[-1][0]
+            follower_ids = [follower_id for _, follower_id in chunk]
+
+            await store_in_inbox(follower_ids, streamer.pk, created_at)
+            if channel_layer is not None:
+                presence = await cache.aget_many([presence_key(user_id) for user_id in follower_ids])
+                online = [user_id for user_id in follower_ids if presence.get(presence_key(user_id), 0) > 0]
+                await asyncio.gather(*(
+                    channel_layer.group_send(notification_group(user_id), event) for user_id in online
+                ))
+            notified += len(follower_ids)
+            await asyncio.sleep(0)
+    except Exception:
+        logger.exception("Go-live fan-out for %s stopped after %d followers", streamer.username, notified)
+
+
+@database_sync_to_async
+def pop_inbox(user_id):
+    """
+    Return the newest undelivered notifications as event payloads and remove them from the inbox.
+    Rows already pushed to a live socket are dropped first. Only the rows read here are deleted,
+    so a notification upserted meanwhile stays for later; older ones past
+    ``NOTIFICATION_INBOX_SIZE`` are dropped.
+    """
+    seen_at = Profile.objects.filter(user_id=user_id).values_list('notifications_seen_at', flat=True).first()
+    if seen_at is not None:
+        GoLiveNotification.objects.filter(user_id=user_id, created_at__lte=seen_at).delete()
+    notifications = list(
+        GoLiveNotification.objects.filter(user_id=user_id, streamer__stream__isnull=False)
+        .select_related('streamer__profile', 'streamer__stream')
+        .order_by('-created_at')[:settings.NOTIFICATION_INBOX_SIZE]
+    )
+    if not notifications:
+        return []
+    read = Q()
+    for notification in notifications:
+        read |= Q(pk=notification.pk, created_at=notification.created_at)
+    if len(notifications) == settings.NOTIFICATION_INBOX_SIZE:
+        read |= Q(created_at__lt=notifications[-1].created_at)
+    GoLiveNotification.objects.filter(read, user_id=user_id).delete()
+    return [
+        {
+            'type': 'go_live',
+            'username': notification.streamer.username,
+            'nickname': notification.streamer.profile.nickname,
+            'stream_uid': notification.streamer.stream.viewer_url,
+            'created_at': notification.created_at.isoformat(),
+        }
+        for notification in notifications
+    ]
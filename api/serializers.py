@@ -1,6 +1,7 @@
 from rest_framework import serializers
 from django.contrib.auth.models import User
-from .models import Stream, Profile
+from .models import Stream, Profile, Ban, ChatFilterRule, ChatFilterSettings
+from .content_filter import MAX_REGEX_RULES, validate_regex
 import requests
 from django.conf import settings
 from django.db import transaction
@@ -9,6 +10,9 @@ import logging
 
 logger = logging.getLogger(__name__)
 
+BULK_MODERATION_MAX_USERS = 1000
+MAX_BAN_DURATION_SECONDS = 365 * 24 * 60 * 60 # Longer timeouts should be permanent bans
+
 class ProfileSerializer(serializers.ModelSerializer):
     username = serializers.CharField(source='user.username', read_only=True)
 
@@ -16,6 +20,57 @@ class ProfileSerializer(serializers.ModelSerializer):
         model = Profile
         fields = ('nickname', 'username')
 
+class ChatFilterSettingsSerializer(serializers.ModelSerializer):
+    class Meta:
+        model = ChatFilterSettings
+        fields = ('block_links', 'duplicate_window_seconds', 'duplicate_limit')
+
+class ChatFilterRuleSerializer(serializers.ModelSerializer):
+    class Meta:
+        model = ChatFilterRule
+        fields = ('id', 'kind', 'pattern', 'ignore_case', 'created_at')
+        read_only_fields = ('id', 'created_at')
+
+    def validate(self, attrs):
+        if attrs.get('kind') == ChatFilterRule.KIND_REGEX:
+            # Re-posting an existing pattern replaces its flags, so it doesn't count against itself
+            existing = list(
+                ChatFilterRule.objects.filter(streamer=self.context['streamer'], kind=ChatFilterRule.KIND_REGEX)
+                .exclude(pattern=attrs['pattern'])
+                .values_list('pattern', 'ignore_case')
+            )
+            if len(existing) >= MAX_REGEX_RULES:
+                raise serializers.ValidationError({'pattern': [f'At most {MAX_REGEX_RULES} regex rules are allowed.']})
+            try:
+                validate_regex(attrs['pattern'], attrs.get('ignore_case', False), existing)
+            except ValueError as e:
+                raise serializers.ValidationError({'pattern': [str(e)]})
+        return attrs
+
+class BannedUserSerializer(serializers.ModelSerializer):
+    banned_username = serializers.CharField(source='banned_user.username')
+
+    class Meta:
+        model = Ban
+        fields = ('banned_username', 'created_at', 'expires_at')
+
+class BanDurationSerializer(serializers.Serializer):
+    duration_seconds = serializers.IntegerField(
+        min_value=1, max_value=MAX_BAN_DURATION_SECONDS, required=False, allow_null=True
+    ) # Omit for a permanent ban
+
+class BulkUnbanSerializer(serializers.Serializer):
+    banned_users = serializers.ListField(
+        child=serializers.CharField(), allow_empty=False, max_length=BULK_MODERATION_MAX_USERS
+    )
+
+class BulkBanSerializer(BulkUnbanSerializer, BanDurationSerializer):
+    pass
+
+class PurgeMessagesSerializer(serializers.Serializer):
+    username = serializers.CharField()
+    minutes = serializers.IntegerField(min_value=1, max_value=24 * 60, default=10)
+
 class UserPasswordSerializer(serializers.Serializer):
     old_password = serializers.CharField(required=True)
     new_password = serializers.CharField(required=True)
@@ -1,3 +1,718 @@
-from django.test import TestCase
+import functools
+import importlib
+import random
+import sys
+import threading
+import time
+from contextvars import copy_context
+from datetime import datetime, timedelta, timezone as dt_timezone
+from unittest import mock
 
-# Create your tests here.
+from asgiref.sync import async_to_sync
+from channels.db import database_sync_to_async
+from channels.layers import get_channel_layer
+from channels.routing import URLRouter
+from channels.testing import WebsocketCommunicator
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.db import DatabaseError
+from django.test import SimpleTestCase, TestCase, TransactionTestCase
+from django.utils import timezone
+import requests
+from rest_framework.authtoken.models import Token
+from rest_framework.test import APIClient
+
+from . import content_filter, tracing
+from .ban_scheduler import BanExpiryScheduler
+from .login_pool import get_login_token, token_cache_key
+from .chat_stats import MAX_FLUSH_ATTEMPTS, ChatStatsAggregator, HyperLogLog, summarize
+from .display_names import DisplayNameCache, broadcast_display_name_change, display_names
+from .content_filter import ContentFilter, DuplicateTracker, TermMatcher, normalize, validate_regex
+from .models import Ban, ChatFilterRule, ChatMessage, ChatStatsBucket, Follow, GoLiveNotification, Stream
+from .routing import websocket_urlpatterns
+from .notifications import (
+    fan_out_go_live, mark_offline, mark_online, notification_group, pop_inbox, presence_key,
+)
+
+
+class TermMatcherTests(SimpleTestCase):
+    def test_matches_like_naive_search(self):
+        rng = random.Random(0)
+        for _ in range(200):
+            terms = [''.join(rng.choice('abc') for _ in range(rng.randint(1, 4))) for _ in range(rng.randint(1, 6))]
+            text = ''.join(rng.choice('abcd') for _ in range(rng.randint(0, 30)))
+            expected = any(term in text for term in terms)
+            self.assertEqual(TermMatcher(terms).search(text), expected, (terms, text))
+
+    def test_terms_are_case_folded(self):
+        matcher = TermMatcher(['Spam', 'STRASSE'])
+        self.assertTrue(matcher.search(normalize('buy SPAM now')))
+        self.assertTrue(matcher.search(normalize('Straße')))
+        self.assertFalse(matcher.search(normalize('spa m')))
+
+    def test_empty_matcher_is_falsy(self):
+        self.assertFalse(TermMatcher([]))
+        self.assertFalse(TermMatcher(['   ']))
+
+
+class ValidateRegexTests(SimpleTestCase):
+    def test_accepts_simple_patterns(self):
+        for pattern in (r'BUY\d+', r'[A-Z]{5,}', r'[a-z]+\d+', r'(?:foo|bar)baz'):
+            validate_regex(pattern)
+
+    def test_rejects_invalid_and_capturing(self):
+        for pattern in ('(', '(x)', r'(?P<name>x)'):
+            with self.assertRaises(ValueError):
+                validate_regex(pattern)
+
+    def test_rejects_inline_global_flags(self):
+        # Fine on its own, but breaks the joined alternation on Python 3.11+
+        with self.assertRaises(ValueError):
+            validate_regex('(?i)spam')
+
+    def test_rejects_catastrophic_backtracking(self):
+        for pattern in (r'(?:a+)+$', r'(?:a|ab)*c', r'\w+\s+\w+\s+\w+'):
+            with self.assertRaises(ValueError):
+                validate_regex(pattern)
+
+    def test_checks_joined_with_existing(self):
+        validate_regex('spam', existing=[(r'BUY\d+', True), ('eggs', False)])
+
+    def test_scoped_case_flag_is_allowed(self):
+        validate_regex('spam', ignore_case=True, existing=[(r'[A-Z]{5,}', False)])
+
+
+class ContentFilterTests(SimpleTestCase):
+    def test_case_is_a_per_rule_choice(self):
+        content = ContentFilter(patterns=[(r'BUY\d+', True), (r'[A-Z]{5,}', False)])
+        self.assertEqual(content.check('buy123 today'), 'banned pattern')
+        self.assertEqual(content.check('STOP SHOUTING'), 'banned pattern')
+        self.assertIsNone(content.check('hello there'))
+
+    def test_skips_patterns_that_no_longer_compile(self):
+        with self.assertLogs('api.content_filter', 'WARNING'):
+            content = ContentFilter(patterns=[('(?i)spam', False), (r'BUY\d+', False)])
+        self.assertEqual(content.check('BUY123'), 'banned pattern')
+
+    def test_regex_scan_is_bounded(self):
+        content = ContentFilter(patterns=[(r'[a-z]+\d+', False)])
+        started = time.perf_counter()
+        self.assertIsNone(content.check('a' * 50000 + '1'))
+        self.assertLess(time.perf_counter() - started, 0.5)
+        self.assertEqual(content.check('abc1'), 'banned pattern')
+
+    def test_terms_and_links(self):
+        content = ContentFilter(terms=['spam'], block_links=True)
+        self.assertEqual(content.check('SPAM!'), 'banned term')
+        self.assertEqual(content.check('see example.com'), 'links are not allowed')
+        self.assertIsNone(content.check('hello'))
+
+    def test_duplicates(self):
+        content = ContentFilter(duplicate_window_seconds=30, duplicate_limit=2)
+        tracker = DuplicateTracker()
+        self.assertIsNone(content.check('hi', 1, tracker))
+        self.assertIsNone(content.check('HI ', 1, tracker))
+        self.assertEqual(content.check('hi', 1, tracker), 'repeated message')
+        self.assertIsNone(content.check('hi', 2, tracker))
+
+
+class DuplicateTrackerTests(SimpleTestCase):
+    def test_window_expires(self):
+        tracker = DuplicateTracker()
+        self.assertFalse(tracker.is_duplicate(1, 'x', 10, 1, now=0))
+        self.assertTrue(tracker.is_duplicate(1, 'x', 10, 1, now=5))
+        self.assertFalse(tracker.is_duplicate(1, 'x', 10, 1, now=20))
+
+
+class ContentFilterRegistryTests(TestCase):
+    def setUp(self):
+        self.streamer = User.objects.create_user('streamer', password='pw')
+        content_filter.discard_content_filter(self.streamer.pk)
+
+    def test_version_bump_reaches_cached_filter(self):
+        self.assertIsNone(content_filter.load_content_filter(self.streamer).check('spam'))
+        ChatFilterRule.objects.create(streamer=self.streamer, pattern='spam')
+        # Another process changed the rules: only the shared version moves
+        content_filter.bump_version(content_filter.filter_scope(self.streamer.pk))
+        with self.settings(CHAT_FILTER_RECHECK_SECONDS=0):
+            self.assertEqual(content_filter.load_content_filter(self.streamer).check('spam'), 'banned term')
+
+    def test_registry_is_bounded(self):
+        with self.settings(CHAT_FILTER_CACHE_SIZE=2):
+            for streamer_id in range(1000, 1005):
+                content_filter.get_duplicate_tracker(streamer_id)
+            self.assertLessEqual(len(content_filter._trackers), 2)
+
+
+class ChatFilterRuleViewTests(TestCase):
+    def setUp(self):
+        self.streamer = User.objects.create_user('streamer', password='pw')
+        self.client = APIClient()
+        self.client.force_authenticate(self.streamer)
+
+    def test_rejects_pattern_that_breaks_the_join(self):
+        response = self.client.post('/api/filters/rules/', {'kind': 'regex', 'pattern': '(?i)spam'}, format='json')
+        self.assertEqual(response.status_code, 400)
+        self.assertFalse(ChatFilterRule.objects.exists())
+
+    def test_creates_rule(self):
+        response = self.client.post('/api/filters/rules/', {'kind': 'regex', 'pattern': r'BUY\d+'}, format='json')
+        self.assertEqual(response.status_code, 201)
+        self.assertFalse(ChatFilterRule.objects.get(streamer=self.streamer, kind='regex').ignore_case)
+
+    def test_reposting_updates_case_flag(self):
+        ChatFilterRule.objects.create(streamer=self.streamer, kind='regex', pattern=r'BUY\d+')
+        response = self.client.post('/api/filters/rules/', {
+            'kind': 'regex', 'pattern': r'BUY\d+', 'ignore_case': True,
+        }, format='json')
+        self.assertEqual(response.status_code, 201)
+        self.assertTrue(ChatFilterRule.objects.get(streamer=self.streamer, kind='regex').ignore_case)
+
+
+@mock.patch('api.views.ban_scheduler')
+class BulkModerationViewTests(TestCase):
+    def setUp(self):
+        self.streamer = User.objects.create_user('streamer', password='pw')
+        self.viewers = [User.objects.create_user(f'viewer{i}', password='pw') for i in range(3)]
+        self.client = APIClient()
+        self.client.force_authenticate(self.streamer)
+
+    def test_bulk_ban(self, scheduler):
+        response = self.client.post('/api/ban/bulk/', {
+            'banned_users': ['viewer0', 'viewer1', 'streamer', 'ghost'],
+        }, format='json')
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(response.data, {'banned': ['viewer0', 'viewer1'], 'not_found': ['ghost']})
+        self.assertEqual(Ban.objects.filter(streamer=self.streamer, expires_at__isnull=True).count(), 2)
+        scheduler.schedule_many.assert_not_called()
+
+    def test_bulk_ban_replaces_expiry(self, scheduler):
+        Ban.objects.create(streamer=self.streamer, banned_user=self.viewers[0])
+        response = self.client.post('/api/ban/bulk/', {
+            'banned_users': ['viewer0'], 'duration_seconds': 60,
+        }, format='json')
+        self.assertEqual(response.status_code, 201)
+        ban = Ban.objects.get(streamer=self.streamer, banned_user=self.viewers[0])
+        self.assertIsNotNone(ban.expires_at)
+        scheduled = list(scheduler.schedule_many.call_args.args[0])
+        self.assertEqual(scheduled, [(ban.pk, ban.expires_at)])
+
+    def test_bulk_unban(self, scheduler):
+        for viewer in self.viewers[:2]:
+            Ban.objects.create(streamer=self.streamer, banned_user=viewer)
+        response = self.client.post('/api/unban/bulk/', {'banned_users': ['viewer0', 'viewer2']}, format='json')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data, {'unbanned': 1})
+        self.assertEqual(list(Ban.objects.values_list('banned_user__username', flat=True)), ['viewer1'])
+
+    def test_ban_duration_is_bounded(self, scheduler):
+        for url, payload in (('/api/ban/', {'banned_user': 'viewer0'}), ('/api/ban/bulk/', {'banned_users': ['viewer0']})):
+            response = self.client.post(url, {**payload, 'duration_seconds': 10 ** 12}, format='json')
+            self.assertEqual(response.status_code, 400, url)
+        self.assertFalse(Ban.objects.exists())
+
+    def test_bulk_ban_rejects_empty_list(self, scheduler):
+        response = self.client.post('/api/ban/bulk/', {'banned_users': []}, format='json')
+        self.assertEqual(response.status_code, 400)
+
+
+class PurgeMessagesViewTests(TestCase):
+    def setUp(self):
+        self.streamer = User.objects.create_user('streamer', password='pw')
+        self.viewer = User.objects.create_user('viewer', password='pw')
+        other = User.objects.create_user('other', password='pw')
+        self.stream = Stream.objects.create(user=self.streamer, stream_key='key', stream_url='url', viewer_url='uid')
+        other_stream = Stream.objects.create(user=other, stream_key='key2', stream_url='url2', viewer_url='uid2')
+        ChatMessage.objects.create(user=self.viewer, stream=self.stream, message='recent')
+        old = ChatMessage.objects.create(user=self.viewer, stream=self.stream, message='old')
+        ChatMessage.objects.filter(pk=old.pk).update(timestamp=timezone.now() - timedelta(hours=1))
+        ChatMessage.objects.create(user=self.viewer, stream=other_stream, message='elsewhere')
+        ChatMessage.objects.create(user=other, stream=self.stream, message='someone else')
+        self.client = APIClient()
+        self.client.force_authenticate(self.streamer)
+
+    def test_purges_recent_messages_of_user_in_own_room(self):
+        with mock.patch('api.views.PURGE_BATCH_SIZE', 1):
+            response = self.client.post('/api/purge/', {'username': 'viewer', 'minutes': 10}, format='json')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data, {'purged': 1})
+        self.assertEqual(
+            sorted(ChatMessage.objects.values_list('message', flat=True)),
+            ['elsewhere', 'old', 'someone else'],
+        )
+
+    def test_unknown_user(self):
+        response = self.client.post('/api/purge/', {'username': 'ghost'}, format='json')
+        self.assertEqual(response.status_code, 404)
+
+
+class BanExpiryTests(TestCase):
+    def setUp(self):
+        self.streamer = User.objects.create_user('streamer', password='pw')
+        self.viewer = User.objects.create_user('viewer', password='pw')
+
+    def test_active_ignores_expired_bans(self):
+        ban = Ban.objects.create(streamer=self.streamer, banned_user=self.viewer,
+                                 expires_at=timezone.now() - timedelta(seconds=1))
+        self.assertFalse(Ban.objects.active().exists())
+        Ban.objects.filter(pk=ban.pk).update(expires_at=None)
+        self.assertTrue(Ban.objects.active().exists())
+
+    def test_expire_skips_extended_bans(self):
+        expired = Ban.objects.create(streamer=self.streamer, banned_user=self.viewer,
+                                     expires_at=timezone.now() - timedelta(seconds=1))
+        extended = Ban.objects.create(streamer=self.viewer, banned_user=self.streamer,
+                                      expires_at=timezone.now() + timedelta(hours=1))
+        with mock.patch('api.ban_scheduler.close_old_connections'):
+            BanExpiryScheduler()._expire([expired.pk, extended.pk])
+        self.assertEqual(list(Ban.objects.values_list('pk', flat=True)), [extended.pk])
+
+    def test_loads_pending_expiries(self):
+        ban = Ban.objects.create(streamer=self.streamer, banned_user=self.viewer,
+                                 expires_at=timezone.now() + timedelta(hours=1))
+        Ban.objects.create(streamer=self.viewer, banned_user=self.streamer)
+        scheduler = BanExpiryScheduler()
+        with mock.patch('api.ban_scheduler.close_old_connections'), mock.patch.object(scheduler, 'start'):
+            scheduler._load_pending()
+        self.assertEqual([ban_id for _, ban_id in scheduler._heap], [ban.pk])
+
+    def test_started_by_the_asgi_application_only(self):
+        with mock.patch('api.ban_scheduler.ban_scheduler.start') as start:
+            if 'stream_hub.asgi' in sys.modules:
+                importlib.reload(sys.modules['stream_hub.asgi'])
+            else:
+                importlib.import_module('stream_hub.asgi')
+        start.assert_called_once_with()
+
+
+class HyperLogLogTests(SimpleTestCase):
+    def test_estimates_within_error(self):
+        for n in (10, 1000, 50000):
+            sketch = HyperLogLog()
+            for value in range(n):
+                sketch.add(value)
+            self.assertAlmostEqual(sketch.count(), n, delta=max(n * 0.1, 1))
+
+    def test_merge_counts_union(self):
+        a, b = HyperLogLog(), HyperLogLog()
+        for value in range(3000):
+            a.add(value)
+        for value in range(2000, 6000):
+            b.add(value)
+        a.merge(b)
+        self.assertAlmostEqual(a.count(), 6000, delta=600)
+
+    def test_duplicates_do_not_count(self):
+        sketch = HyperLogLog()
+        for _ in range(100):
+            sketch.add(42)
+        self.assertEqual(sketch.count(), 1)
+
+
+class ChatStatsFlushTests(TestCase):
+    def setUp(self):
+        streamer = User.objects.create_user('streamer', password='pw')
+        self.stream = Stream.objects.create(user=streamer, stream_key='key', stream_url='url', viewer_url='uid')
+        self.minute = datetime(2024, 1, 1, 12, 0, tzinfo=dt_timezone.utc)
+        self.aggregator = ChatStatsAggregator(flush_interval=3600)
+        self.aggregator._thread = object() # Keep record() from starting the background thread
+
+    def record(self, user_id, username, count=1, stream_id=None):
+        for _ in range(count):
+            self.aggregator.record(stream_id or self.stream.pk, user_id, username, now=self.minute + timedelta(seconds=5))
+
+    def test_flush_merges_into_existing_row(self):
+        self.record(1, 'alice', 3)
+        self.aggregator.flush()
+        self.record(1, 'alice')
+        self.record(2, 'bob', 2)
+        self.aggregator.flush()
+        row = ChatStatsBucket.objects.get(stream=self.stream, minute=self.minute)
+        self.assertEqual(row.message_count, 6)
+        self.assertEqual(row.chatter_estimate, 2)
+        self.assertEqual(row.top_chatters, {'alice': 4, 'bob': 2})
+
+        stats = summarize(self.stream, self.minute, self.minute + timedelta(minutes=1))
+        self.assertEqual(stats['messages'], 6)
+        self.assertEqual(stats['unique_chatters'], 2)
+        self.assertEqual(stats['top_chatters'][0], {'username': 'alice', 'messages': 4})
+
+    def failing_write(self, failing_stream_id):
+        write = self.aggregator._write
+
+        def _write(stream_id, minute, bucket):
+            if stream_id == failing_stream_id:
+                raise DatabaseError('unavailable')
+            write(stream_id, minute, bucket)
+        return mock.patch.object(self.aggregator, '_write', _write)
+
+    def test_failed_bucket_is_requeued_without_dropping_others(self):
+        other = Stream.objects.create(
+            user=User.objects.create_user('other', password='pw'), stream_key='key2', stream_url='url2', viewer_url='uid2',
+        )
+        self.record(1, 'alice', 2, stream_id=other.pk)
+        self.record(2, 'bob')
+        with self.failing_write(other.pk), self.assertLogs('api.chat_stats', 'WARNING'):
+            self.aggregator.flush()
+        self.assertEqual(ChatStatsBucket.objects.get(stream=self.stream).message_count, 1)
+
+        self.record(1, 'alice', stream_id=other.pk)
+        self.aggregator.flush()
+        self.assertEqual(ChatStatsBucket.objects.get(stream=other).message_count, 3)
+
+    def test_failing_bucket_is_eventually_dropped(self):
+        self.record(1, 'alice')
+        with self.failing_write(self.stream.pk), self.assertLogs('api.chat_stats', 'WARNING'):
+            for _ in range(MAX_FLUSH_ATTEMPTS):
+                self.aggregator.flush()
+        self.assertEqual(self.aggregator._pending, {})
+
+
+class LoginViewTests(TransactionTestCase):
+    def setUp(self):
+        cache.clear()
+        User.objects.create_user('alice', password='correct-horse')
+
+    def login(self, username, password, ip='10.0.0.1'):
+        return self.client.post(
+            '/api/login/', {'username': username, 'password': password},
+            content_type='application/json', REMOTE_ADDR=ip,
+        )
+
+    def test_success(self):
+        response = self.login('alice', 'correct-horse')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()['username'], 'alice')
+        self.assertTrue(response.json()['token'])
+
+    def test_non_string_credentials_are_rejected(self):
+        for username, password in ((123, 'pw'), (['alice'], 'pw'), ('alice', {'a': 1}), (None, 'pw')):
+            response = self.login(username, password)
+            self.assertEqual(response.status_code, 400, (username, password))
+            self.assertEqual(response.json(), {'error': 'Invalid Credentials'})
+
+    def test_throttles_username_after_repeated_failures(self):
+        with self.settings(LOGIN_FAILURE_LIMIT_USERNAME=3, LOGIN_FAILURE_LIMIT_IP=100):
+            for i in range(3):
+                self.assertEqual(self.login('alice', 'wrong', ip=f'10.0.0.{i}').status_code, 400)
+            response = self.login('alice', 'correct-horse', ip='10.0.1.1')
+            self.assertEqual(response.status_code, 429)
+            self.assertIn('Retry-After', response)
+            self.assertEqual(self.login('bob', 'wrong', ip='10.0.1.1').status_code, 400)
+
+    def test_throttles_ip_after_repeated_failures(self):
+        with self.settings(LOGIN_FAILURE_LIMIT_USERNAME=100, LOGIN_FAILURE_LIMIT_IP=2):
+            self.login('alice', 'wrong')
+            self.login('mallory', 'wrong')
+            self.assertEqual(self.login('alice', 'correct-horse').status_code, 429)
+            self.assertEqual(self.login('alice', 'correct-horse', ip='10.0.0.2').status_code, 200)
+
+    def test_success_clears_username_failures(self):
+        with self.settings(LOGIN_FAILURE_LIMIT_USERNAME=2, LOGIN_FAILURE_LIMIT_IP=100):
+            self.login('alice', 'wrong')
+            self.assertEqual(self.login('alice', 'correct-horse').status_code, 200)
+            self.login('alice', 'wrong')
+            self.assertEqual(self.login('alice', 'correct-horse').status_code, 200)
+
+
+class LoginTokenCacheTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create_user('alice', password='pw')
+
+    def test_cached_with_a_finite_timeout(self):
+        with mock.patch('api.login_pool.cache.set', wraps=cache.set) as cache_set:
+            token_key = get_login_token(self.user)
+        cache_set.assert_called_once_with(token_cache_key(self.user.pk), token_key, timeout=3600)
+        self.assertEqual(get_login_token(self.user), token_key)
+
+    def test_token_deleted_by_concurrent_logout_is_not_cached(self):
+        real_set = cache.set
+
+        def logout_then_set(*args, **kwargs):
+            Token.objects.filter(user=self.user).delete() # Logout lands between get_or_create and set
+            real_set(*args, **kwargs)
+
+        with mock.patch('api.login_pool.cache.set', side_effect=logout_then_set):
+            token_key = get_login_token(self.user)
+        self.assertTrue(Token.objects.filter(key=token_key).exists())
+        self.assertIsNone(cache.get(token_cache_key(self.user.pk)))
+
+
+class GoLiveNotificationTests(TransactionTestCase):
+    def setUp(self):
+        cache.clear()
+        self.streamer = User.objects.create_user('streamer', password='pw')
+        self.stream = Stream.objects.create(user=self.streamer, stream_key='key', stream_url='url', viewer_url='uid')
+        self.online = User.objects.create_user('online', password='pw')
+        self.offline = User.objects.create_user('offline', password='pw')
+        for follower in (self.online, self.offline):
+            Follow.objects.create(follower=follower, streamer=self.streamer)
+
+    def test_fan_out_always_writes_the_inbox(self):
+        async def run():
+            layer = get_channel_layer()
+            channel = await layer.new_channel()
+            await layer.group_add(notification_group(self.online.pk), channel)
+            await mark_online(self.online.pk)
+            await mark_online(self.offline.pk) # Leaked by a crashed process: no socket behind it
+            await fan_out_go_live(self.stream)
+            return await layer.receive(channel)
+
+        event = async_to_sync(run)()
+        self.assertEqual(event['username'], 'streamer')
+        self.assertEqual(
+            set(GoLiveNotification.objects.values_list('user_id', flat=True)), {self.online.pk, self.offline.pk},
+        )
+
+        # Nothing deleted per push; the offline follower's row is delivered on connect
+        self.assertEqual([payload['username'] for payload in async_to_sync(pop_inbox)(self.offline.pk)], ['streamer'])
+        self.assertEqual(list(GoLiveNotification.objects.values_list('user_id', flat=True)), [self.online.pk])
+
+    def test_pushed_notifications_are_not_redelivered(self):
+        async def connect():
+            communicator = WebsocketCommunicator(URLRouter(websocket_urlpatterns), '/ws/notifications/')
+            communicator.scope['user'] = self.online
+            connected, _ = await communicator.connect()
+            self.assertTrue(connected)
+            return communicator
+
+        async def run():
+            communicator = await connect()
+            await fan_out_go_live(self.stream)
+            pushed = await communicator.receive_json_from()
+            await communicator.disconnect()
+
+            communicator = await connect()
+            redelivered = await communicator.receive_nothing()
+            await communicator.disconnect()
+            return pushed, redelivered
+
+        pushed, redelivered = async_to_sync(run)()
+        self.assertEqual(pushed['username'], 'streamer')
+        self.assertTrue(redelivered)
+        self.assertFalse(GoLiveNotification.objects.filter(user=self.online).exists())
+        self.assertTrue(GoLiveNotification.objects.filter(user=self.offline).exists())
+
+    def test_cloudflare_webhook_rejects_non_object_data(self):
+        with self.settings(CLOUDFLARE_WEBHOOK_SECRET='secret'):
+            for body in ('{"data": []}', '{"data": null}'):
+                response = self.client.post(
+                    '/api/webhooks/cloudflare/', body, content_type='application/json', HTTP_CF_WEBHOOK_AUTH='secret',
+                )
+                self.assertEqual(response.status_code, 400, body)
+
+    def test_pop_inbox_drops_overflow(self):
+        other = User.objects.create_user('other', password='pw')
+        Stream.objects.create(user=other, stream_key='key2', stream_url='url2', viewer_url='uid2')
+        now = timezone.now()
+        GoLiveNotification.objects.create(user=self.offline, streamer=self.streamer, created_at=now - timedelta(minutes=1))
+        GoLiveNotification.objects.create(user=self.offline, streamer=other, created_at=now)
+        with self.settings(NOTIFICATION_INBOX_SIZE=1):
+            payloads = async_to_sync(pop_inbox)(self.offline.pk)
+        self.assertEqual([payload['username'] for payload in payloads], ['other'])
+        self.assertFalse(GoLiveNotification.objects.exists())
+
+    def test_presence_counts_sockets(self):
+        async def run():
+            await mark_online(self.online.pk)
+            await mark_online(self.online.pk)
+            await mark_offline(self.online.pk)
+            first = await cache.aget(presence_key(self.online.pk))
+            await mark_offline(self.online.pk)
+            return first, await cache.aget(presence_key(self.online.pk))
+
+        self.assertEqual(async_to_sync(run)(), (1, None))
+
+
+class TracingTests(SimpleTestCase):
+    def recorder(self, **options):
+        options = {'sample_rate': 1.0, 'threshold_ms': 0, 'buffer_size': 100, 'max_captures': 10,
+                   'stack_sampling': False, **options}
+        return mock.patch.object(tracing, 'recorder', tracing.TraceRecorder(**options))
+
+    def test_spans_form_a_tree(self):
+        with self.recorder() as recorder:
+            with tracing.start_trace('root') as root:
+                with tracing.span('child') as child:
+                    self.assertIs(root.trace.active, child)
+                self.assertIs(root.trace.active, root)
+        self.assertIsNone(root.trace.active)
+        self.assertEqual(child.parent_id, root.span_id)
+        self.assertEqual([span.name for span in recorder.captures[0].spans], ['child', 'root'])
+
+    def test_unsampled_trace_is_noop(self):
+        with self.recorder(sample_rate=0.0) as recorder:
+            with tracing.start_trace('root'):
+                self.assertIs(tracing.span('child'), tracing.NOOP_SPAN)
+        self.assertFalse(recorder.captures)
+
+    def test_db_span_runs_in_worker_thread(self):
+        @tracing.traced_db('db.lookup')
+        def lookup():
+            return threading.get_ident()
+
+        async def run():
+            with tracing.start_trace('root') as root:
+                return root, await lookup()
+
+        with self.recorder():
+            root, worker = async_to_sync(run)()
+        db_span = next(span for span in root.trace.spans if span.name == 'db.lookup')
+        self.assertEqual(db_span.thread_id, worker)
+        self.assertNotEqual(db_span.thread_id, root.thread_id)
+        self.assertEqual(db_span.parent_id, root.span_id)
+
+    def test_stack_sampled_from_innermost_span_thread(self):
+        def slow_query_in_worker():
+            with tracing.span('db.slow'):
+                time.sleep(0.3)
+
+        with self.recorder(threshold_ms=20, stack_sampling=True):
+            with tracing.start_trace('root') as root:
+                worker = threading.Thread(target=slow_query_in_worker)
+                # Threads don't inherit contextvars; hand over the current span like asgiref does
+                worker.run = functools.partial(copy_context().run, worker.run)
+                worker.start()
+                worker.join()
+        self.assertIn('slow_query_in_worker', root.trace.stack)
+
+
+class ChatConsumerTests(TransactionTestCase):
+    def setUp(self):
+        cache.clear()
+        self.streamer = User.objects.create_user('streamer', password='pw')
+        Stream.objects.create(user=self.streamer, stream_key='key', stream_url='url', viewer_url='uid')
+        self.viewer = User.objects.create_user('viewer', password='pw')
+        ChatFilterRule.objects.create(streamer=self.streamer, pattern='spam')
+        content_filter.discard_content_filter(self.streamer.pk)
+
+    def test_chat_round_trip(self):
+        async def run():
+            communicator = WebsocketCommunicator(URLRouter(websocket_urlpatterns), '/ws/chat/streamer/')
+            communicator.scope['user'] = self.viewer
+            connected, _ = await communicator.connect()
+            self.assertTrue(connected)
+            await communicator.send_json_to({'message': 'buy spam'})
+            blocked = await communicator.receive_json_from()
+            await communicator.send_json_to({'message': 'x' * 5000})
+            too_long = await communicator.receive_json_from()
+            await communicator.send_json_to({'message': 'hello'})
+            delivered = await communicator.receive_json_from()
+            await communicator.disconnect()
+            return blocked, too_long, delivered
+
+        with mock.patch('api.consumers.chat_stats'), self.settings(CHAT_MESSAGE_MAX_LENGTH=300):
+            blocked, too_long, delivered = async_to_sync(run)()
+        self.assertEqual(blocked, {'error': 'Your message was blocked: banned term.'})
+        self.assertEqual(too_long, {'error': 'Messages can be at most 300 characters.'})
+        self.assertEqual(delivered['message'], 'hello')
+        self.assertEqual(delivered['username'], 'viewer')
+        self.assertEqual(list(ChatMessage.objects.values_list('message', flat=True)), ['hello'])
+
+
+def cloudflare_live(*uids):
+    response = mock.Mock()
+    response.json.return_value = {'result': [{'uid': uid, 'status': 'live', 'thumbnail': f'{uid}.jpg'} for uid in uids]}
+    return response
+
+
+class ResponseCachingTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.streamer = User.objects.create_user('streamer', password='pw')
+        Stream.objects.create(user=self.streamer, stream_key='secret-key', stream_url='url', viewer_url='uid')
+        self.client = APIClient()
+
+    @mock.patch('api.views.requests.get', return_value=cloudflare_live())
+    def test_user_list_not_modified(self, _):
+        response = self.client.get('/api/users/')
+        self.assertEqual(response.status_code, 200)
+        self.assertIn('public', response['Cache-Control'])
+        response = self.client.get('/api/users/', HTTP_IF_NONE_MATCH=response['ETag'])
+        self.assertEqual(response.status_code, 304)
+
+    @mock.patch('api.views.requests.get', return_value=cloudflare_live())
+    def test_profile_change_changes_etag(self, _):
+        etag = self.client.get('/api/users/')['ETag']
+        self.client.force_authenticate(self.streamer)
+        with self.captureOnCommitCallbacks(execute=True):
+            self.assertEqual(self.client.put('/api/profile/', {'nickname': 'Renamed'}, format='json').status_code, 200)
+        response = self.client.get('/api/users/', HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response['ETag'], etag)
+        self.assertEqual(response.data[0]['nickname'], 'Renamed')
+
+    def test_failed_cloudflare_lookup_is_not_cached(self):
+        with mock.patch('api.views.requests.get', side_effect=requests.exceptions.ConnectionError()):
+            self.assertFalse(self.client.get('/api/users/').data[0]['is_live'])
+        with mock.patch('api.views.requests.get', return_value=cloudflare_live('uid')):
+            self.assertTrue(self.client.get('/api/users/').data[0]['is_live'])
+
+    def test_stream_info_is_private(self):
+        response = self.client.get('/api/stream/streamer/')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response['Cache-Control'], 'private, no-cache')
+        self.assertEqual(self.client.get('/api/stream/streamer/', HTTP_IF_NONE_MATCH=response['ETag']).status_code, 304)
+
+
+class DisplayNameCacheTests(SimpleTestCase):
+    def test_evicts_least_recently_used(self):
+        names = DisplayNameCache(maxsize=2, ttl=60)
+        names.set(1, 'one')
+        names.set(2, 'two')
+        names.get(1)
+        names.set(3, 'three')
+        self.assertEqual((names.get(1), names.get(2), names.get(3)), ('one', None, 'three'))
+
+    def test_entries_expire(self):
+        names = DisplayNameCache(maxsize=10, ttl=60)
+        with mock.patch('api.display_names.time.monotonic', return_value=1000):
+            names.set(1, 'one')
+        with mock.patch('api.display_names.time.monotonic', return_value=1059):
+            self.assertEqual(names.get(1), 'one')
+        with mock.patch('api.display_names.time.monotonic', return_value=1061):
+            self.assertIsNone(names.get(1))
+
+
+class ChatDisplayNameTests(TransactionTestCase):
+    def setUp(self):
+        self.streamer = User.objects.create_user('streamer', password='pw')
+        self.stream = Stream.objects.create(user=self.streamer, stream_key='key', stream_url='url', viewer_url='uid')
+        self.viewer = User.objects.create_user('viewer', password='pw')
+        self.viewer.profile.nickname = 'Viewer'
+        self.viewer.profile.save()
+        display_names.set(self.viewer.pk, 'Viewer')
+
+    async def connect(self):
+        communicator = WebsocketCommunicator(URLRouter(websocket_urlpatterns), '/ws/chat/streamer/')
+        communicator.scope['user'] = self.viewer
+        connected, _ = await communicator.connect()
+        self.assertTrue(connected)
+        return communicator
+
+    def test_history_uses_the_nickname_loaded_with_it(self):
+        ChatMessage.objects.create(user=self.viewer, stream=self.stream, message='earlier')
+        display_names.set(self.viewer.pk, 'Stale') # Left over from another process
+
+        async def run():
+            communicator = await self.connect()
+            history = await communicator.receive_json_from()
+            await communicator.disconnect()
+            return history
+
+        self.assertEqual(async_to_sync(run)()['display_name'], 'Viewer')
+        self.assertEqual(display_names.get(self.viewer.pk), 'Viewer')
+
+    def test_nickname_change_reaches_open_session(self):
+        async def run():
+            communicator = await self.connect()
+            await database_sync_to_async(broadcast_display_name_change)(self.viewer.pk, 'Renamed')
+            await communicator.receive_nothing() # Let the event arrive
+            await communicator.send_json_to({'message': 'hello'})
+            delivered = await communicator.receive_json_from()
+            await communicator.disconnect()
+            return delivered
+
+        with mock.patch('api.consumers.chat_stats'):
+            self.assertEqual(async_to_sync(run)()['display_name'], 'Renamed')
@@ -2,6 +2,7 @@ from channels.db import database_sync_to_async
 from django.contrib.auth.models import AnonymousUser
 from rest_framework.authtoken.models import Token
 from urllib.parse import parse_qs
+from .tracing import new_connection_id, start_trace
 
 @database_sync_to_async
 def get_user(token_key):
@@ -21,8 +22,11 @@ class TokenAuthMiddleware:
         token_values = params.get("token", [])
         token_key = token_values[0] if token_values else None
 
+        # Ties every span of this WebSocket session together
+        scope['trace_connection_id'] = new_connection_id()
         if token_key:
-            scope['user'] = await get_user(token_key)
+            with start_trace('ws.auth', connection=scope['trace_connection_id'], path=scope.get('path')):
+                scope['user'] = await get_user(token_key)
         else:
             scope['user'] = AnonymousUser()
         
@@ -0,0 +1,311 @@
+import functools
+import itertools
+import json
+import os
+import random
+import sys
+import threading
+import time
+import traceback
+from collections import deque
+from contextvars import ContextVar
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from channels.db import database_sync_to_async
+from django.conf import settings
+
+_current_span = ContextVar('current_span', default=None)
+_ids = itertools.count(1)
+
+
+class _NoopSpan:
+    """
+    Returned whenever a trace isn't sampled, so disabled tracing costs one call and a branch.
+    """
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        return False
+
+    def set(self, key, value):
+        pass
+
+
+NOOP_SPAN = _NoopSpan()
+
+
+class Trace:
+    __slots__ = ('trace_id', 'root', 'spans', 'active', 'stack')
+
+    def __init__(self):
+        self.trace_id = next(_ids)
+        self.root = None
+        self.spans = []
+        self.active = None # Innermost open span; its thread is the one worth sampling
+        self.stack = None
+
+
+class Span:
+    __slots__ = ('name', 'trace', 'span_id', 'parent', 'attrs', 'thread_id', 'start_ns', 'end_ns', '_token')
+
+    def __init__(self, name, trace, parent, attrs):
+        self.name = name
+        self.trace = trace
+        self.span_id = next(_ids)
+        self.parent = parent
+        self.attrs = attrs
+        self.thread_id = None
+        self.start_ns = None
+        self.end_ns = None
+
+    def set(self, key, value):
+        self.attrs[key] = value
+
+    def __enter__(self):
+        self.thread_id = threading.get_ident()
+        self.start_ns = time.perf_counter_ns()
+        self._token = _current_span.set(self)
+        self.trace.active = self
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.end_ns = time.perf_counter_ns()
+        _current_span.reset(self._token)
+        if self.trace.active is self:
+            self.trace.active = self.parent
+        if exc_type is not None:
+            self.attrs['error'] = exc_type.__name__
+        self.trace.spans.append(self)
+        if self.trace.root is self:
+            recorder.finish(self.trace)
+        return False
+
+    @property
+    def parent_id(self):
+        return self.parent.span_id if self.parent is not None else None
+
+    @property
+    def duration_ms(self):
+        return (self.end_ns - self.start_ns) / 1e6
+
+    def as_dict(self):
+        return {
+            'name': self.name,
+            'trace_id': self.trace.trace_id,
+            'span_id': self.span_id,
+            'parent_id': self.parent_id,
+            'duration_ms': round(self.duration_ms, 3),
+            'attrs': self.attrs,
+        }
+
+    def as_chrome_event(self):
+        # Chrome/Perfetto "complete" event; timestamps are microseconds
+        return {
+            'name': self.name,
+            'cat': 'streamhub',
+            'ph': 'X',
+            'ts': self.start_ns / 1000,
+            'dur': (self.end_ns - self.start_ns) / 1000,
+            'pid': os.getpid(),
+            'tid': self.thread_id,
+            'args': {
+                **self.attrs,
+                'trace_id': self.trace.trace_id,
+                'span_id': self.span_id,
+                'parent_id': self.parent_id,
+            },
+        }
+
+
+class TraceRecorder:
+    """
+    Keeps finished spans in a ring buffer and the full span tree of every trace slower than
+    ``threshold_ms``. With ``stack_sampling`` a watchdog thread also snapshots the stack of
+    the thread running the trace's innermost open span once it crosses the threshold.
+    """
+    def __init__(self, sample_rate, threshold_ms, buffer_size, max_captures, stack_sampling):
+        self.sample_rate = sample_rate
+        self.threshold_ns = threshold_ms * 1_000_000
+        self.spans = deque(maxlen=buffer_size)
+        self.captures = deque(maxlen=max_captures)
+        self.stack_sampling = stack_sampling
+        self._active = {}
+        self._lock = threading.Lock()
+        self._sampler = None
+
+    def start_trace(self, name, attrs):
+        if not self.sample_rate or random.random() >= self.sample_rate:
+            return NOOP_SPAN
+        trace = Trace()
+        trace.root = Span(name, trace, None, attrs)
+        if self.stack_sampling:
+            with self._lock:
+                self._active[trace.trace_id] = trace
+                if self._sampler is None:
+                    self._sampler = threading.Thread(target=self._sample_stacks, name='trace-stack-sampler', daemon=True)
+                    self._sampler.start()
+        return trace.root
+
+    def finish(self, trace):
+        root = trace.root
+        with self._lock:
+            self._active.pop(trace.trace_id, None)
+            self.spans.extend(trace.spans)
+            if root.end_ns - root.start_ns >= self.threshold_ns:
+                self.captures.append(trace)
+
+    def _sample_stacks(self):
+        interval = max(self.threshold_ns / 2e9, 0.01)
+        while True:
+            time.sleep(interval)
+            now = time.perf_counter_ns()
+            with self._lock:
+                slow = [
+                    trace for trace in self._active.values()
+                    if trace.stack is None and trace.root.start_ns is not None
+                    and now - trace.root.start_ns >= self.threshold_ns
+                ]
+            if not slow:
+                continue
+            frames = sys._current_frames()
+            for trace in slow:
+                active = trace.active
+                if active is None:
+                    continue
+                frame = frames.get(active.thread_id)
+                if frame is not None:
+                    trace.stack = ''.join(traceback.format_stack(frame))
+
+    def snapshot(self, include_all=False):
+        with self._lock:
+            captures = list(self.captures)
+            spans = list(self.spans) if include_all else None
+        return captures, spans
+
+
+recorder = TraceRecorder(
+    settings.TRACING_SAMPLE_RATE,
+    settings.TRACING_SLOW_THRESHOLD_MS,
+    settings.TRACING_BUFFER_SIZE,
+    settings.TRACING_MAX_CAPTURES,
+    settings.TRACING_STACK_SAMPLING,
+)
+
+
+def start_trace(name, **attrs):
+    """
+    Open a root span, or a child if a trace is already running in this context.
+    """
+    parent = _current_span.get()
+    if parent is not None:
+        return Span(name, parent.trace, parent, attrs)
+    return recorder.start_trace(name, attrs)
+
+
+def span(name, **attrs):
+    """
+    Open a child span of the current trace; a no-op outside a sampled trace.
+    """
+    parent = _current_span.get()
+    if parent is None:
+        return NOOP_SPAN
+    return Span(name, parent.trace, parent, attrs)
+
+
+def traced(name):
+    """
+    Wrap an async callable in a child span.
+    """
+    def decorator(func):
+        @functools.wraps(func)
+        async def wrapper(*args, **kwargs):
+            with span(name):
+                return await func(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+def traced_db(name):
+    """
+    ``database_sync_to_async`` with the child span opened inside the worker thread, so the span
+    records (and the stack sampler inspects) the thread that actually runs the query.
+    """
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            with span(name):
+                return func(*args, **kwargs)
+        return database_sync_to_async(wrapper)
+    return decorator
+
+
+def traced_handler(name):
+    """
+    Wrap a consumer handler in a root span tagged with the connection id set by TokenAuthMiddleware.
+    """
+    def decorator(func):
+        @functools.wraps(func)
+        async def wrapper(self, *args, **kwargs):
+            with start_trace(name, connection=self.scope.get('trace_connection_id')):
+                return await func(self, *args, **kwargs)
+        return wrapper
+    return decorator
+
+
+def new_connection_id():
+    return next(_ids)
+
+
+def capture_as_dict(trace):
+    return {
+        'trace_id': trace.trace_id,
+        'name': trace.root.name,
+        'duration_ms': round(trace.root.duration_ms, 3),
+        'attrs': trace.root.attrs,
+        'spans': [span.as_dict() for span in trace.spans],
+        'stack': trace.stack,
+    }
+
+
+def chrome_trace(traces=(), spans=()):
+    events = [span.as_chrome_event() for trace in traces for span in trace.spans]
+    events.extend(span.as_chrome_event() for span in spans)
+    return {'traceEvents': events, 'displayTimeUnit': 'ms'}
+
+
+def export_chrome_trace(path, include_all=False):
+    captures, spans = recorder.snapshot(include_all)
+    data = chrome_trace(spans=spans) if include_all else chrome_trace(traces=captures)
+    os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+    with open(path, 'w') as f:
+        json.dump(data, f, default=str)
+    return len(data['traceEvents'])
+
+
+class TracingMiddleware:
+    """
+    Root span per HTTP request. Works for sync and async views without an adapter hop.
+    """
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.is_async = iscoroutinefunction(get_response)
+        if self.is_async:
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if self.is_async:
+            return self.__acall__(request)
+        with start_trace('http', method=request.method, path=request.path) as root:
+            response = self.get_response(request)
+            root.set('status', response.status_code)
+            return response
+
+    async def __acall__(self, request):
+        with start_trace('http', method=request.method, path=request.path) as root:
+            response = await self.get_response(request)
+            root.set('status', response.status_code)
+            return response
@@ -9,7 +9,18 @@ urlpatterns = [
     path('users/', views.UserListView.as_view(), name='user-list'),
     path('profile/', views.ProfileView.as_view(), name='profile'),
     path('password/change/', views.PasswordChangeView.as_view(), name='password_change'),
+    path('stream/<str:username>/stats/', views.StreamStatsView.as_view(), name='stream-stats'),
     path('stream/<str:username>/banned/', views.BannedUsersListView.as_view(), name='banned-users'),
     path('ban/', views.BanView.as_view(), name='ban'),
     path('unban/', views.UnbanView.as_view(), name='unban'),
+    path('ban/bulk/', views.BulkBanView.as_view(), name='ban-bulk'),
+    path('unban/bulk/', views.BulkUnbanView.as_view(), name='unban-bulk'),
+    path('purge/', views.PurgeMessagesView.as_view(), name='purge-messages'),
+    path('follow/', views.FollowView.as_view(), name='follow'),
+    path('unfollow/', views.UnfollowView.as_view(), name='unfollow'),
+    path('webhooks/cloudflare/', views.CloudflareWebhookView.as_view(), name='cloudflare-webhook'),
+    path('debug/traces/', views.TraceDumpView.as_view(), name='debug-traces'),
+    path('filters/', views.ChatFilterView.as_view(), name='chat-filters'),
+    path('filters/rules/', views.ChatFilterRuleCreateView.as_view(), name='chat-filter-rule-create'),
+    path('filters/rules/<int:pk>/', views.ChatFilterRuleDeleteView.as_view(), name='chat-filter-rule-delete'),
 ]
\ No newline at end of file
@@ -1,30 +1,94 @@
+import hmac
+import json
+import os
 import requests
+from datetime import timedelta, timezone as dt_timezone
+from asgiref.sync import async_to_sync
+from channels.layers import get_channel_layer
 from django.conf import settings
+from django.utils import timezone
+from django.http import JsonResponse
+from django.utils.decorators import method_decorator
+from django.views import View
+from django.views.decorators.csrf import csrf_exempt
 from rest_framework import generics, status
 from rest_framework.response import Response
 from rest_framework.views import APIView
 from django.contrib.auth.models import User
 from django.contrib.auth import authenticate
-from rest_framework.authtoken.models import Token
-from .serializers import UserSerializer, ProfileSerializer, UserPasswordSerializer
-from .models import Stream, Ban, ChatMessage, Profile # Import Profile
+from .serializers import (
+    UserSerializer, ProfileSerializer, UserPasswordSerializer,
+    ChatFilterRuleSerializer, ChatFilterSettingsSerializer, BannedUserSerializer,
+    BanDurationSerializer, BulkBanSerializer, BulkUnbanSerializer, PurgeMessagesSerializer,
+)
+from .models import Stream, Ban, ChatMessage, Profile, ChatFilterRule, ChatFilterSettings, Follow
 from django.contrib.auth import update_session_auth_hash # For password change
-from rest_framework import permissions, serializers # Added serializers import
+from .caching import conditional_response, stream_info_scope, UncachedPayload, USER_LIST_SCOPE
+from .display_names import broadcast_display_name_change
+from .content_filter import broadcast_filter_change
+from .ban_scheduler import ban_scheduler
+from .chat_stats import summarize
+from .notifications import set_live_state, schedule_go_live
+from .tracing import recorder, capture_as_dict, chrome_trace, export_chrome_trace
+from .login_pool import (
+    LoginPoolSaturated, password_pool, is_throttled, record_failure, clear_failures, get_login_token,
+)
+from django.utils.dateparse import parse_datetime
+from rest_framework.pagination import CursorPagination
+from rest_framework import permissions
 
 class SignUpView(generics.CreateAPIView):
     queryset = User.objects.all()
     serializer_class = UserSerializer
 
-class LoginView(APIView):
-    def post(self, request):
-        username = request.data.get('username')
-        password = request.data.get('password')
-        user = authenticate(username=username, password=password)
-        if user:
-            token, _ = Token.objects.get_or_create(user=user)
-            return Response({'token': token.key, 'username': user.username, 'nickname': user.profile.nickname})
+def verify_login(username, password):
+    # Runs on password_pool: the hash check plus the DB work it needs, in one thread hop
+    user = authenticate(username=username, password=password)
+    if user is None:
+        return None
+    return {'token': get_login_token(user), 'username': user.username, 'nickname': user.profile.nickname}
+
+# Async so PBKDF2 never runs on the thread ASGI shares between all sync views
+@method_decorator(csrf_exempt, name='dispatch')
+class LoginView(View):
+    async def post(self, request):
+        if request.content_type == 'application/json':
+            try:
+                data = json.loads(request.body or b'{}')
+            except ValueError:
+                return JsonResponse({'error': 'Malformed JSON.'}, status=status.HTTP_400_BAD_REQUEST)
+            if not isinstance(data, dict):
+                data = {}
         else:
-            return Response({'error': 'Invalid Credentials'}, status=status.HTTP_400_BAD_REQUEST)
+            data = request.POST
+        username = data.get('username')
+        password = data.get('password')
+        ip = request.META.get('REMOTE_ADDR', '')
+        # Refused before throttling or hashing; these can never authenticate
+        if not isinstance(username, str) or not isinstance(password, str):
+            return JsonResponse({'error': 'Invalid Credentials'}, status=status.HTTP_400_BAD_REQUEST)
+
+        if await is_throttled(ip, username):
+            return JsonResponse(
+                {'error': 'Too many failed login attempts. Try again later.'},
+                status=status.HTTP_429_TOO_MANY_REQUESTS,
+                headers={'Retry-After': str(settings.LOGIN_FAILURE_WINDOW)},
+            )
+
+        try:
+            payload = await password_pool.run(verify_login, username, password)
+        except LoginPoolSaturated:
+            return JsonResponse(
+                {'error': 'Login service is busy. Try again shortly.'},
+                status=status.HTTP_503_SERVICE_UNAVAILABLE,
+                headers={'Retry-After': '1'},
+            )
+
+        if payload is None:
+            await record_failure(ip, username)
+            return JsonResponse({'error': 'Invalid Credentials'}, status=status.HTTP_400_BAD_REQUEST)
+        await clear_failures(ip, username)
+        return JsonResponse(payload)
 
 class LogoutView(APIView):
     permission_classes = [permissions.IsAuthenticated]
@@ -37,16 +101,23 @@ class LogoutView(APIView):
 
 class StreamInfoView(APIView):
     def get(self, request, username):
-        try:
-            user = User.objects.get(username=username)
-            stream = Stream.objects.get(user=user)
-            return Response({
+        def build():
+            user = User.objects.select_related('stream', 'profile').get(username=username)
+            stream = user.stream
+            return {
                 'username': user.username,
                 'nickname': user.profile.nickname if hasattr(user, 'profile') else None, # Include nickname
                 'stream_key': stream.stream_key,
                 'stream_url': stream.stream_url,
                 'stream_uid': stream.viewer_url,
-            })
+            }
+
+        try:
+            # private: the payload carries stream_key, the streamer's publish credential
+            return conditional_response(
+                request, stream_info_scope(username), build, settings.STREAM_INFO_CACHE_TIMEOUT,
+                cache_control='private, no-cache',
+            )
         except User.DoesNotExist:
             return Response({'error': 'User not found'}, status=status.HTTP_404_NOT_FOUND)
         except Stream.DoesNotExist:
@@ -54,7 +125,13 @@ class StreamInfoView(APIView):
 
 class UserListView(APIView):
     def get(self, request):
+        return conditional_response(
+            request, USER_LIST_SCOPE, self.build_user_list, settings.USER_LIST_CACHE_TIMEOUT
+        )
+
+    def build_user_list(self):
         live_streams_data = {}
+        lookup_failed = False
         try:
             headers = {'Authorization': f'Bearer {settings.CLOUDFLARE_API_TOKEN}'}
             url = f"https://api.cloudflare.com/client/v4/accounts/{settings.CLOUDFLARE_ACCOUNT_ID}/stream/live_inputs"
@@ -68,6 +145,7 @@ class UserListView(APIView):
 
         except requests.exceptions.RequestException as e:
             print(f"Could not fetch live status from Cloudflare: {e}")
+            lookup_failed = True
 
         users = User.objects.select_related('stream', 'profile').all().order_by('username')
         response_data = []
@@ -84,8 +162,65 @@ class UserListView(APIView):
                 'is_live': is_live,
                 'thumbnail': thumbnail,
             })
-            
-        return Response(response_data)
+
+        if lookup_failed:
+            # Everyone looks offline; serve it, but don't pin it in the cache for the whole TTL
+            raise UncachedPayload(response_data)
+        return response_data
+
+class FollowView(APIView):
+    permission_classes = [permissions.IsAuthenticated]
+
+    def post(self, request):
+        streamer_username = request.data.get('streamer')
+        if request.user.username == streamer_username:
+            return Response({'error': 'You cannot follow yourself.'}, status=status.HTTP_400_BAD_REQUEST)
+        try:
+            streamer = User.objects.get(username=streamer_username)
+            Follow.objects.get_or_create(follower=request.user, streamer=streamer)
+            return Response({'status': f'You are following {streamer_username}.'}, status=status.HTTP_201_CREATED)
+        except User.DoesNotExist:
+            return Response({'error': 'Streamer not found.'}, status=status.HTTP_404_NOT_FOUND)
+
+class UnfollowView(APIView):
+    permission_classes = [permissions.IsAuthenticated]
+
+    def post(self, request):
+        streamer_username = request.data.get('streamer')
+        deleted, _ = Follow.objects.filter(follower=request.user, streamer__username=streamer_username).delete()
+        if not deleted:
+            return Response({'error': 'Follow record not found.'}, status=status.HTTP_404_NOT_FOUND)
+        return Response({'status': f'You unfollowed {streamer_username}.'}, status=status.HTTP_200_OK)
+
+LIVE_INPUT_EVENTS = {
+    'live_input.connected': True,
+    'live_input.disconnected': False,
+}
+
+# Async so the follower fan-out can run as a task on the server's event loop after we respond
+@method_decorator(csrf_exempt, name='dispatch')
+class CloudflareWebhookView(View):
+    async def post(self, request):
+        secret = settings.CLOUDFLARE_WEBHOOK_SECRET
+        provided = request.headers.get('cf-webhook-auth', '')
+        if not secret or not hmac.compare_digest(provided, secret):
+            return JsonResponse({'error': 'Invalid webhook secret.'}, status=status.HTTP_403_FORBIDDEN)
+        try:
+            data = json.loads(request.body).get('data', {})
+        except (ValueError, AttributeError):
+            return JsonResponse({'error': 'Malformed JSON.'}, status=status.HTTP_400_BAD_REQUEST)
+        if not isinstance(data, dict):
+            return JsonResponse({'error': 'Malformed JSON.'}, status=status.HTTP_400_BAD_REQUEST)
+
+        is_live = LIVE_INPUT_EVENTS.get(data.get('event_type'))
+        stream_uid = data.get('input_id')
+        if is_live is None or not stream_uid:
+            return JsonResponse({'status': 'ignored'})
+
+        stream = await set_live_state(stream_uid, is_live)
+        if stream is not None and is_live:
+            schedule_go_live(stream)
+        return JsonResponse({'status': 'accepted'}, status=status.HTTP_202_ACCEPTED)
 
 class ProfileView(APIView):
     permission_classes = [permissions.IsAuthenticated]
@@ -97,9 +232,12 @@ class ProfileView(APIView):
 
     def put(self, request):
         profile = request.user.profile
+        old_nickname = profile.nickname
         serializer = ProfileSerializer(profile, data=request.data, partial=True)
         if serializer.is_valid():
             serializer.save()
+            if profile.nickname != old_nickname:
+                broadcast_display_name_change(request.user.pk, profile.nickname)
             return Response(serializer.data)
         return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
 
@@ -125,22 +263,58 @@ class IsStreamer(permissions.BasePermission):
     def has_permission(self, request, view):
         return request.user.is_authenticated and request.user.username == view.kwargs.get('username')
 
+STATS_DEFAULT_RANGE = timedelta(hours=6)
+STATS_MAX_RANGE = timedelta(days=7)
+
+class StreamStatsView(APIView):
+    permission_classes = [IsStreamer]
+
+    def get(self, request, username):
+        start = self.parse_time(request.query_params.get('start'))
+        end = self.parse_time(request.query_params.get('end'))
+        if start is False or end is False:
+            return Response({'error': 'start/end must be ISO 8601 datetimes.'}, status=status.HTTP_400_BAD_REQUEST)
+        end = end or timezone.now()
+        start = start or end - STATS_DEFAULT_RANGE
+        if start >= end or end - start > STATS_MAX_RANGE:
+            return Response({'error': 'Time range must be positive and at most 7 days.'}, status=status.HTTP_400_BAD_REQUEST)
+        try:
+            stream = Stream.objects.get(user=request.user)
+        except Stream.DoesNotExist:
+            return Response({'error': 'Stream not found'}, status=status.HTTP_404_NOT_FOUND)
+        return Response(summarize(stream, start, end))
+
+    def parse_time(self, value):
+        # None when absent, False when malformed
+        if not value:
+            return None
+        try:
+            parsed = parse_datetime(value)
+        except ValueError:
+            return False
+        if parsed is None:
+            return False
+        if timezone.is_naive(parsed):
+            parsed = timezone.make_aware(parsed, dt_timezone.utc)
+        return parsed
+
+class BanListPagination(CursorPagination):
+    page_size = 100
+    ordering = ('-created_at', '-id')
+
 class BannedUsersListView(generics.ListAPIView):
     permission_classes = [IsStreamer]
+    serializer_class = BannedUserSerializer
+    pagination_class = BanListPagination
 
     def get_queryset(self):
-        streamer_username = self.kwargs['username']
-        streamer = User.objects.get(username=streamer_username)
-        return Ban.objects.filter(streamer=streamer)
-
-    def get_serializer(self, *args, **kwargs):
-        class BannedUserSerializer(serializers.ModelSerializer):
-            banned_username = serializers.CharField(source='banned_user.username')
-            class Meta:
-                model = Ban
-                fields = ('banned_username',)
-        
-        return BannedUserSerializer(*args, **kwargs)
+        # IsStreamer guarantees the URL username is the requesting user
+        return Ban.objects.active().filter(streamer=self.request.user).select_related('banned_user')
+
+def ban_expiry(duration_seconds):
+    if not duration_seconds:
+        return None
+    return timezone.now() + timedelta(seconds=duration_seconds)
 
 class BanView(APIView):
     permission_classes = [permissions.IsAuthenticated]
@@ -152,9 +326,18 @@ class BanView(APIView):
         if streamer.username == banned_user_username:
             return Response({'error': 'You cannot ban yourself.'}, status=status.HTTP_400_BAD_REQUEST)
 
+        duration = BanDurationSerializer(data=request.data)
+        if not duration.is_valid():
+            return Response(duration.errors, status=status.HTTP_400_BAD_REQUEST)
+        expires_at = ban_expiry(duration.validated_data.get('duration_seconds'))
+
         try:
             banned_user = User.objects.get(username=banned_user_username)
-            Ban.objects.get_or_create(streamer=streamer, banned_user=banned_user)
+            ban, _ = Ban.objects.update_or_create(
+                streamer=streamer, banned_user=banned_user, defaults={'expires_at': expires_at}
+            )
+            if expires_at:
+                ban_scheduler.schedule(ban.pk, expires_at)
             return Response({'status': f'{banned_user_username} has been banned.'}, status=status.HTTP_201_CREATED)
         except User.DoesNotExist:
             return Response({'error': 'User to ban not found.'}, status=status.HTTP_404_NOT_FOUND)
@@ -174,3 +357,162 @@ class UnbanView(APIView):
             return Response({'error': 'User to unban not found.'}, status=status.HTTP_404_NOT_FOUND)
         except Ban.DoesNotExist:
             return Response({'error': 'Ban record not found.'}, status=status.HTTP_404_NOT_FOUND)
+
+class BulkBanView(APIView):
+    permission_classes = [permissions.IsAuthenticated]
+
+    def post(self, request):
+        serializer = BulkBanSerializer(data=request.data)
+        if not serializer.is_valid():
+            return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
+        streamer = request.user
+        usernames = set(serializer.validated_data['banned_users'])
+        usernames.discard(streamer.username)
+        expires_at = ban_expiry(serializer.validated_data.get('duration_seconds'))
+
+        users = list(User.objects.filter(username__in=usernames).only('id', 'username'))
+        # Re-banning someone replaces the expiry of their existing ban
+        Ban.objects.bulk_create(
+            [Ban(streamer=streamer, banned_user=user, expires_at=expires_at) for user in users],
+            update_conflicts=True,
+            unique_fields=['streamer', 'banned_user'],
+            update_fields=['expires_at'],
+        )
+        if expires_at and users:
+            ban_scheduler.schedule_many(
+                Ban.objects.filter(streamer=streamer, banned_user__in=users).values_list('pk', 'expires_at')
+            )
+
+        banned = sorted(user.username for user in users)
+        return Response({
+            'banned': banned,
+            'not_found': sorted(usernames.difference(banned)),
+        }, status=status.HTTP_201_CREATED)
+
+class BulkUnbanView(APIView):
+    permission_classes = [permissions.IsAuthenticated]
+
+    def post(self, request):
+        serializer = BulkUnbanSerializer(data=request.data)
+        if not serializer.is_valid():
+            return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
+        deleted, _ = Ban.objects.filter(
+            streamer=request.user, banned_user__username__in=serializer.validated_data['banned_users']
+        ).delete()
+        return Response({'unbanned': deleted}, status=status.HTTP_200_OK)
+
+PURGE_BATCH_SIZE = 500
+
+class PurgeMessagesView(APIView):
+    permission_classes = [permissions.IsAuthenticated]
+
+    def post(self, request):
+        serializer = PurgeMessagesSerializer(data=request.data)
+        if not serializer.is_valid():
+            return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
+        streamer = request.user
+        username = serializer.validated_data['username']
+        try:
+            target = User.objects.get(username=username)
+            stream = Stream.objects.get(user=streamer)
+        except User.DoesNotExist:
+            return Response({'error': 'User not found.'}, status=status.HTTP_404_NOT_FOUND)
+        except Stream.DoesNotExist:
+            return Response({'error': 'Stream not found'}, status=status.HTTP_404_NOT_FOUND)
+
+        since = timezone.now() - timedelta(minutes=serializer.validated_data['minutes'])
+        messages = ChatMessage.objects.filter(stream=stream, user=target, timestamp__gte=since)
+        purged = 0
+        # Small batches keep each DELETE short so chat inserts aren't blocked behind one big lock
+        while True:
+            batch = list(messages.values_list('pk', flat=True)[:PURGE_BATCH_SIZE])
+            if not batch:
+                break
+            purged += ChatMessage.objects.filter(pk__in=batch).delete()[0]
+
+        channel_layer = get_channel_layer()
+        if channel_layer is not None:
+            async_to_sync(channel_layer.group_send)(
+                f'chat_{streamer.username}',
+                {
+                    'type': 'chat_purge',
+                    'username': target.username,
+                }
+            )
+        return Response({'purged': purged}, status=status.HTTP_200_OK)
+
+class ChatFilterView(APIView):
+    permission_classes = [permissions.IsAuthenticated]
+
+    def get(self, request):
+        settings_row, _ = ChatFilterSettings.objects.get_or_create(streamer=request.user)
+        rules = ChatFilterRule.objects.filter(streamer=request.user).order_by('created_at')
+        return Response({
+            'settings': ChatFilterSettingsSerializer(settings_row).data,
+            'rules': ChatFilterRuleSerializer(rules, many=True).data,
+        })
+
+    def put(self, request):
+        settings_row, _ = ChatFilterSettings.objects.get_or_create(streamer=request.user)
+        serializer = ChatFilterSettingsSerializer(settings_row, data=request.data, partial=True)
+        if serializer.is_valid():
+            serializer.save()
+            broadcast_filter_change(request.user)
+            return Response(serializer.data)
+        return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
+
+class ChatFilterRuleCreateView(APIView):
+    permission_classes = [permissions.IsAuthenticated]
+
+    def post(self, request):
+        serializer = ChatFilterRuleSerializer(data=request.data, context={'streamer': request.user})
+        if serializer.is_valid():
+            data = serializer.validated_data
+            rule, created = ChatFilterRule.objects.get_or_create(
+                streamer=request.user, kind=data['kind'], pattern=data['pattern'],
+                defaults={'ignore_case': data.get('ignore_case', False)},
+            )
+            changed = created
+            if not created and rule.ignore_case != data.get('ignore_case', rule.ignore_case):
+                rule.ignore_case = data['ignore_case']
+                rule.save(update_fields=['ignore_case'])
+                changed = True
+            if changed:
+                broadcast_filter_change(request.user)
+            return Response(ChatFilterRuleSerializer(rule).data, status=status.HTTP_201_CREATED)
+        return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
+
+class ChatFilterRuleDeleteView(APIView):
+    permission_classes = [permissions.IsAuthenticated]
+
+    def delete(self, request, pk):
+        deleted, _ = ChatFilterRule.objects.filter(streamer=request.user, pk=pk).delete()
+        if not deleted:
+            return Response({'error': 'Filter rule not found.'}, status=status.HTTP_404_NOT_FOUND)
+        broadcast_filter_change(request.user)
+        return Response(status=status.HTTP_204_NO_CONTENT)
+
+class TraceDumpView(APIView):
+    permission_classes = [permissions.IsAdminUser]
+
+    def get(self, request):
+        include_all = request.query_params.get('all') == '1'
+        captures, spans = recorder.snapshot(include_all)
+        connection = request.query_params.get('connection')
+        if connection:
+            captures = [trace for trace in captures if str(trace.root.attrs.get('connection')) == connection]
+        if request.query_params.get('chrome') == '1':
+            data = chrome_trace(spans=spans) if include_all else chrome_trace(traces=captures)
+            return Response(data, headers={'Content-Disposition': 'attachment; filename="traces.json"'})
+        return Response({
+            'sample_rate': recorder.sample_rate,
+            'threshold_ms': recorder.threshold_ns / 1e6,
+            'captures': [capture_as_dict(trace) for trace in captures],
+        })
+
+    def post(self, request):
+        # Writes the Chrome trace next to the server, for hosts where downloading is awkward
+        include_all = request.data.get('all') in (True, '1', 'true')
+        path = os.path.join(settings.TRACING_EXPORT_DIR, f"trace-{timezone.now():%Y%m%d-%H%M%S}.json")
+        events = export_chrome_trace(path, include_all)
+        return Response({'path': path, 'events': events}, status=status.HTTP_201_CREATED)
@@ -8,6 +8,7 @@ from channels.auth import AuthMiddlewareStack
 from channels.routing import ProtocolTypeRouter, URLRouter
 from django.core.asgi import get_asgi_application
 import api.routing
+from api.ban_scheduler import ban_scheduler
 from api.token_auth_middleware import TokenAuthMiddleware
 
 application = ProtocolTypeRouter({
@@ -19,4 +20,8 @@ application = ProtocolTypeRouter({
             )
         )
     ),
-})
\ No newline at end of file
+})
+
+# Only server processes (daphne, runserver) load the ASGI application, so management commands,
+# tests and scripts that call django.setup() never start the scheduler
+ban_scheduler.start()
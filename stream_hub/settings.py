@@ -1,3 +1,4 @@
+import os
 from pathlib import Path
 from decouple import config
 
@@ -39,6 +40,7 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    'api.tracing.TracingMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'corsheaders.middleware.CorsMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
@@ -168,9 +170,71 @@ else:
         },
     }
 
+if REDIS_URL:
+    CACHES = {
+        "default": {
+            "BACKEND": "django.core.cache.backends.redis.RedisCache",
+            "LOCATION": REDIS_URL,
+        },
+    }
+else:
+    CACHES = {
+        "default": {
+            "BACKEND": "django.core.cache.backends.locmem.LocMemCache",
+        },
+    }
+
+# Server-side response caching for the public stream info / channel directory endpoints.
+# Entries are invalidated by version bumps on writes; the directory TTL also bounds how stale
+# the Cloudflare live flags can get.
+STREAM_INFO_CACHE_TIMEOUT = config('STREAM_INFO_CACHE_TIMEOUT', default=300, cast=int)
+USER_LIST_CACHE_TIMEOUT = config('USER_LIST_CACHE_TIMEOUT', default=15, cast=int)
+
+# Process-wide LRU of chat display names, refreshed by nickname-change broadcasts
+DISPLAY_NAME_CACHE_SIZE = config('DISPLAY_NAME_CACHE_SIZE', default=10000, cast=int)
+DISPLAY_NAME_CACHE_TTL = config('DISPLAY_NAME_CACHE_TTL', default=300, cast=int)
+
+# Longest chat message accepted; longer ones are refused before filtering or saving
+CHAT_MESSAGE_MAX_LENGTH = config('CHAT_MESSAGE_MAX_LENGTH', default=300, cast=int)
+
+# Compiled chat filters are kept per process (LRU of CHAT_FILTER_CACHE_SIZE rooms) and their
+# version is rechecked against the shared cache at most every CHAT_FILTER_RECHECK_SECONDS
+CHAT_FILTER_CACHE_SIZE = config('CHAT_FILTER_CACHE_SIZE', default=256, cast=int)
+CHAT_FILTER_RECHECK_SECONDS = config('CHAT_FILTER_RECHECK_SECONDS', default=10, cast=int)
+
+# How often (seconds) in-memory chat analytics are merged into ChatStatsBucket rollups
+CHAT_STATS_FLUSH_INTERVAL = config('CHAT_STATS_FLUSH_INTERVAL', default=10, cast=int)
+
+# Password verification runs on a bounded pool; logins beyond workers + queue get 503
+LOGIN_HASH_WORKERS = config('LOGIN_HASH_WORKERS', default=min(4, os.cpu_count() or 1), cast=int)
+LOGIN_HASH_QUEUE = config('LOGIN_HASH_QUEUE', default=32, cast=int)
+
+# Failed logins per client IP / per username allowed within the window before 429, checked before hashing
+LOGIN_FAILURE_LIMIT_IP = config('LOGIN_FAILURE_LIMIT_IP', default=20, cast=int)
+LOGIN_FAILURE_LIMIT_USERNAME = config('LOGIN_FAILURE_LIMIT_USERNAME', default=5, cast=int)
+LOGIN_FAILURE_WINDOW = config('LOGIN_FAILURE_WINDOW', default=900, cast=int)
+
+# Login caches each user's token key for this long (seconds); logout clears it immediately
+LOGIN_TOKEN_CACHE_TIMEOUT = config('LOGIN_TOKEN_CACHE_TIMEOUT', default=3600, cast=int)
+
+# Latency tracing. Sample rate 0 turns spans into no-ops; traces slower than the threshold are
+# kept with their full span tree (and a stack snapshot when sampling stacks) for /api/debug/traces/
+TRACING_SAMPLE_RATE = config('TRACING_SAMPLE_RATE', default=0.0, cast=float)
+TRACING_SLOW_THRESHOLD_MS = config('TRACING_SLOW_THRESHOLD_MS', default=250, cast=int)
+TRACING_BUFFER_SIZE = config('TRACING_BUFFER_SIZE', default=10000, cast=int)
+TRACING_MAX_CAPTURES = config('TRACING_MAX_CAPTURES', default=100, cast=int)
+TRACING_STACK_SAMPLING = config('TRACING_STACK_SAMPLING', default='False', cast=bool)
+TRACING_EXPORT_DIR = config('TRACING_EXPORT_DIR', default=str(BASE_DIR / 'traces'))
+
 # Cloudflare API credentials (optional in development)
 CLOUDFLARE_API_TOKEN = config('CLOUDFLARE_API_TOKEN', default='')
 CLOUDFLARE_ACCOUNT_ID = config('CLOUDFLARE_ACCOUNT_ID', default='')
+# Secret configured on the Cloudflare Notifications webhook (sent as cf-webhook-auth); empty disables the webhook
+CLOUDFLARE_WEBHOOK_SECRET = config('CLOUDFLARE_WEBHOOK_SECRET', default='')
+
+# Go-live fan-out: followers per channel-layer batch, and how many pending notifications a reconnect delivers
+NOTIFICATION_FANOUT_CHUNK_SIZE = config('NOTIFICATION_FANOUT_CHUNK_SIZE', default=500, cast=int)
+NOTIFICATION_INBOX_SIZE = config('NOTIFICATION_INBOX_SIZE', default=50, cast=int)
 
 REST_FRAMEWORK = {
     'DEFAULT_AUTHENTICATION_CLASSES': [